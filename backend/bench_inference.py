@@ -0,0 +1,136 @@
+# Benchmark of the inference backends on tiny randomly initialised local models
+# Exercises export, quantization, artifact caching and inference for both tasks without
+# downloading anything, and compares latency, throughput and RSS against eager fp32.
+# Each backend runs in its own process so RSS figures don't mix.
+# Run with: python bench_inference.py [--iterations 200]
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from inference import BACKENDS, InferenceModel
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "<eos>"] + (
+    "i have a fever cough headache and chest pain since two days feel anxious tired "
+    "cannot sleep my blood pressure is high sugar thirst breathing wheezing joint"
+).split()
+
+SAMPLES = [
+    "i have a fever and cough since two days",
+    "chest pain and my blood pressure is high",
+    "i feel anxious and cannot sleep",
+    "joint pain and headache"
+]
+
+
+def _tokenizer():
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {token: i for i, token in enumerate(VOCAB)}
+    tokenizer = Tokenizer(models.WordLevel(vocab=vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]",
+        cls_token="[CLS]", sep_token="[SEP]", eos_token="<eos>"
+    )
+
+
+def build_tiny_models(root):
+    """Save a tiny random classifier and causal LM with a shared word-level tokenizer"""
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    tokenizer = _tokenizer()
+    paths = {}
+
+    classifier = BertForSequenceClassification(BertConfig(
+        vocab_size=len(VOCAB), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=128, max_position_embeddings=64, num_labels=5
+    ))
+    paths["text-classification"] = os.path.join(root, "tiny-symptom-classifier")
+    classifier.save_pretrained(paths["text-classification"])
+    tokenizer.save_pretrained(paths["text-classification"])
+
+    generator = GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(VOCAB), n_embd=64, n_layer=2, n_head=2, n_positions=64,
+        bos_token_id=4, eos_token_id=4, pad_token_id=0
+    ))
+    paths["text-generation"] = os.path.join(root, "tiny-chat-model")
+    generator.save_pretrained(paths["text-generation"])
+    tokenizer.save_pretrained(paths["text-generation"])
+    return paths
+
+
+def _rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_backend(task, model_path, backend, cache_dir, iterations):
+    kwargs = {"max_new_tokens": 8, "do_sample": False} if task == "text-generation" else {}
+    model = InferenceModel(task, model_path, backend=backend, cache_dir=cache_dir, intra_op_threads=1)
+
+    started = time.perf_counter()
+    model.prepare()
+    outputs = [model(sample, **kwargs) for sample in SAMPLES]
+    load_seconds = time.perf_counter() - started
+
+    latencies = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        model(SAMPLES[i % len(SAMPLES)], **kwargs)
+        latencies.append(time.perf_counter() - started)
+
+    if task == "text-classification":
+        outputs = [output[0]["label"] for output in outputs]
+    else:
+        outputs = [output[0]["generated_text"] for output in outputs]
+
+    return {
+        "load": load_seconds,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000,
+        "throughput": iterations / sum(latencies),
+        "rss": _rss_mb(),
+        "outputs": outputs
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as root:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            paths = pool.submit(build_tiny_models, root).result()
+        cache_dir = os.path.join(root, "model_cache")
+
+        for task, model_path in paths.items():
+            print(f"\n{task}")
+            print(f"  {'backend':<11} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8} {'RSS MB':>8}  agrees with eager")
+            reference = None
+            for backend in BACKENDS:
+                # Second onnx run shows the start-up time with a cached artifact
+                for label in ([backend, backend + " (cached)"] if backend == "onnx-int8" else [backend]):
+                    with ProcessPoolExecutor(1, mp_context=context) as pool:
+                        result = pool.submit(run_backend, task, model_path, backend, cache_dir, args.iterations).result()
+                    if reference is None:
+                        reference = result["outputs"]
+                    agreement = sum(a == b for a, b in zip(result["outputs"], reference))
+                    print(f"  {label:<11} {result['load']:7.2f} {result['p50']:8.2f} {result['p95']:8.2f} "
+                          f"{result['throughput']:8.1f} {result['rss']:8.1f}  {agreement}/{len(reference)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Benchmark of sharded datastore ingestion
+# Writes synthetic CSV shards with the datastore1.csv schema (with a few malformed rows
+# mixed in), then ingests them with a growing number of worker processes and compares
+# against the old approach: one pandas read of all rows followed by the analyzers' groupbys.
+# Run with: python bench_ingest.py [--shards 64] [--rows 50000] [--workers 1,2,4,8]
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import CROSSTAB_COLUMNS, default_workers, ingest
+
+HEADER = "Age,Gender,Disease,Blood Type,Billing Amount,Medication,Test Result,Age_Bin,Disease_Med_Interaction,Row_Parity\n"
+
+
+def write_shard(path, rows, seed):
+    rng = np.random.default_rng(seed)
+    age = rng.integers(18, 90, rows)
+    disease = rng.integers(0, 5, rows)
+    medication = rng.integers(0, 5, rows)
+    frame = pd.DataFrame({
+        "Age": age,
+        "Gender": rng.integers(0, 2, rows),
+        "Disease": disease,
+        "Blood Type": rng.integers(0, 8, rows),
+        "Billing Amount": rng.integers(50, 5000, rows) * 10,
+        "Medication": medication,
+        "Test Result": rng.integers(0, 2, rows),
+        "Age_Bin": np.where(age >= 50, 2, np.where(age >= 30, 1, 0)),
+        "Disease_Med_Interaction": disease * 5 + medication,
+        "Row_Parity": np.arange(rows) % 2
+    })
+    lines = frame.to_csv(index=False, header=False).splitlines()
+    # About one malformed row in ten thousand: a bad value or a truncated line
+    for position in rng.choice(rows, max(1, rows // 10000), replace=False):
+        lines[position] = "n/a" + lines[position][2:] if position % 2 else lines[position][:5]
+    with open(path, "w") as f:
+        f.write(HEADER)
+        f.write("\n".join(lines))
+        f.write("\n")
+
+
+def single_read(paths):
+    """The previous loader: one DataFrame of every row, then one groupby per table"""
+    frame = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    for column in CROSSTAB_COLUMNS:
+        frame.groupby(["Disease", column]).size()
+    frame.groupby("Disease")["Billing Amount"].mean()
+    return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=50000, help="rows per shard")
+    parser.add_argument("--workers", default=None, help="comma separated worker counts")
+    args = parser.parse_args()
+
+    cpus = default_workers()
+    counts = [int(count) for count in args.workers.split(",")] if args.workers else \
+        sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(args.shards):
+            write_shard(os.path.join(root, f"shard-{i:04d}.csv"), args.rows, i)
+        paths = sorted(glob.glob(os.path.join(root, "*.csv")))
+        size_mb = sum(os.path.getsize(path) for path in paths) / 1024 / 1024
+        print(f"{args.shards} shards x {args.rows} rows ({size_mb:.0f} MB), {cpus} CPUs\n")
+
+        started = time.perf_counter()
+        single_read(paths)
+        baseline = time.perf_counter() - started
+        print(f"{'single pandas read':<20} {baseline:8.2f} s")
+
+        first = None
+        for workers in counts:
+            aggregates = ingest(root, workers=workers)
+            first = first or aggregates.seconds
+            print(f"{f'{workers} worker(s)':<20} {aggregates.seconds:8.2f} s   "
+                  f"speedup {first / aggregates.seconds:4.1f}x vs 1 worker, "
+                  f"{baseline / aggregates.seconds:4.1f}x vs single read")
+
+        shard_seconds = np.array([shard["seconds"] for shard in aggregates.shards])
+        print(f"\nPer-shard parse+aggregate: min {shard_seconds.min() * 1000:.0f} ms, "
+              f"median {np.median(shard_seconds) * 1000:.0f} ms, max {shard_seconds.max() * 1000:.0f} ms")
+        print(f"Rows ingested {aggregates.rows}, malformed rows skipped {aggregates.malformed_rows}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Benchmark of the memory-mapped knowledge store against loading the source JSON
+# Builds synthetic knowledge bases of growing size and compares start-up time, memory
+# and lookup latency. Each measurement runs in a fresh process so RSS figures are clean.
+# Run with: python bench_knowledge_store.py [--sizes 1000,10000,100000]
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from knowledge_store import KnowledgeStore, build
+
+WORDS = ("chronic acute pain fever blood pressure heart lung kidney liver infection "
+         "inflammation therapy dose daily risk family history diet exercise").split()
+LOOKUPS = 20000
+
+
+def synthetic_records(count):
+    rng = random.Random(0)
+
+    def text(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    return {
+        f"condition_{i:07d}": {
+            "id": f"C-{i:07d}",
+            "name": text(3).title(),
+            "description": text(25),
+            "risk_factors": [text(3) for _ in range(5)],
+            "complications": [text(2) for _ in range(4)],
+            "treatments": [text(2) for _ in range(4)],
+            "prevention": [text(3) for _ in range(3)]
+        }
+        for i in range(count)
+    }
+
+
+def _rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(kind, json_path, store_path, count):
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    if kind == "json dict":
+        with open(json_path, encoding="utf-8") as f:
+            db = json.load(f)
+    else:
+        db = KnowledgeStore(store_path)
+    startup_ms = (time.perf_counter() - started) * 1000
+    rss_after_start = _rss_mb() - rss_before
+
+    rng = random.Random(1)
+    keys = [f"condition_{rng.randrange(count):07d}" for _ in range(LOOKUPS)]
+    started = time.perf_counter()
+    for key in keys:
+        db[key]["name"]
+    lookup_us = (time.perf_counter() - started) / LOOKUPS * 1e6
+
+    hot_keys = keys[:100]
+    started = time.perf_counter()
+    for _ in range(LOOKUPS // 100):
+        for key in hot_keys:
+            db[key]["name"]
+    hot_us = (time.perf_counter() - started) / LOOKUPS * 1e6
+    return startup_ms, rss_after_start, lookup_us, hot_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'records':>8} {'kind':<10} {'file MB':>8} {'startup ms':>11} {'RSS MB':>7} {'random us':>10} {'hot us':>7}")
+    with tempfile.TemporaryDirectory() as root:
+        for count in (int(size) for size in args.sizes.split(",")):
+            records = synthetic_records(count)
+            json_path = os.path.join(root, f"kb-{count}.json")
+            store_path = os.path.join(root, f"kb-{count}.akb")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+            build(records, store_path, search_fields=("name", "description"))
+            del records
+
+            for kind, path in (("json dict", json_path), ("mmap store", store_path)):
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    startup_ms, rss, lookup_us, hot_us = pool.submit(measure, kind, json_path, store_path, count).result()
+                size_mb = os.path.getsize(path) / 1024 / 1024
+                print(f"{count:>8} {kind:<10} {size_mb:8.1f} {startup_ms:11.2f} {rss:7.1f} {lookup_us:10.2f} {hot_us:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
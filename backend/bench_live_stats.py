@@ -0,0 +1,61 @@
+# Benchmark of the live statistics sketches
+# Feeds synthetic report traffic through LiveStats, then compares the sketch answers
+# with exact counts and quantiles and reports the cost per observation. Memory stays
+# the same however many observations are recorded.
+# Run with: python bench_live_stats.py [--observations 200000]
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from live_stats import LiveStats, category_key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--observations", type=int, default=200000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    observations = []
+    for _ in range(args.observations):
+        age_bin = rng.choices([0, 1, 2], weights=[3, 4, 3])[0]
+        categories = {
+            "ageBin": age_bin,
+            "gender": rng.randint(0, 1),
+            "bloodType": rng.randint(0, 7),
+            "testResult": rng.randint(0, 1),
+            "highRisk": int(rng.random() < 0.1 + 0.2 * age_bin)
+        }
+        values = {"healthScore": rng.betavariate(5, 2) * 100, "billingAmount": rng.lognormvariate(7, 0.8)}
+        observations.append((categories, values, f"client-{rng.randint(0, 20000)}"))
+
+    stats = LiveStats(("healthScore", "billingAmount"))
+    started = time.perf_counter()
+    for categories, values, client in observations:
+        stats.record(categories, values, client)
+    elapsed = time.perf_counter() - started
+    merged, _ = stats.snapshot(3600)
+
+    print(f"{args.observations} observations, {elapsed / args.observations * 1e6:.2f} us each, "
+          f"sketch memory {stats.memory_bytes() / 1024 / 1024:.1f} MB (fixed)")
+
+    print("\nHigh-risk count by age bin (count-min vs exact)")
+    for age_bin in range(3):
+        exact = sum(1 for c, _, _ in observations if c["ageBin"] == age_bin and c["highRisk"])
+        print(f"  ageBin={age_bin}: {merged.cms.estimate(category_key(ageBin=age_bin, highRisk=1))} vs {exact}")
+
+    exact_clients = len({client for _, _, client in observations})
+    print(f"\nDistinct clients (HyperLogLog vs exact): {merged.hll.estimate()} vs {exact_clients}")
+
+    for name in ("healthScore", "billingAmount"):
+        exact = np.array([values[name] for _, values, _ in observations])
+        print(f"\n{name} quantiles (t-digest vs exact)")
+        for q in (0.5, 0.9, 0.99):
+            print(f"  p{int(q * 100)}: {merged.digests[name].quantile(q):.2f} vs {np.quantile(exact, q):.2f}")
+
+
+if __name__ == "__main__":
+    main()
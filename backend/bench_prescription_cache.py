@@ -0,0 +1,104 @@
+# Benchmark of the prescription image dedup cache
+# Measures lookup cost per tier against a cold lookup, checks which re-encoded copies
+# of an image still hit with near-duplicate matching on (and that a page with one line
+# changed does not), and exercises size-bounded eviction of the disk tier.
+# Run with: python bench_prescription_cache.py
+
+import io
+import random
+import statistics
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from image_cache import PrescriptionCache
+
+ITERATIONS = 200
+
+
+def prescription_image(seed, size=(1200, 1600)):
+    """A synthetic scanned page: dark text-like bars on white"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x = rng.randint(50, size[0] // 2)
+        y = rng.randint(0, size[1])
+        draw.rectangle([x, y, x + rng.randint(100, size[0] // 2), y + rng.randint(8, 30)], fill=(20, 20, 60))
+    return image
+
+
+def with_changed_line(image):
+    """The same page with one short bar added, like a different dose on the same letterhead"""
+    image = image.copy()
+    ImageDraw.Draw(image).rectangle([700, 1500, 820, 1520], fill=(20, 20, 60))
+    return image
+
+
+def encode(image, fmt="JPEG", **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def timed(func, *args):
+    samples = []
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    original = prescription_image(1)
+    data = encode(original, quality=90)
+    result = {"medications": [{"name": "Metformin", "dosage": "500mg"}], "diagnoses": ["Diabetes"]}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PrescriptionCache(cache_dir, max_distance=4)
+        _, _, key = cache.lookup(data)
+        cache.store(key, result)
+
+        print("Lookup latency (p50 ms)")
+        print(f"  memory hit       {timed(cache.lookup, data):8.3f}")
+
+        def disk_hit():
+            cache.memory.clear()
+            cache.lookup(data)
+        print(f"  disk hit         {timed(disk_hit):8.3f}")
+
+        copy = encode(original, quality=70)
+        print(f"  perceptual hit   {timed(cache.lookup, copy):8.3f}")
+        other = encode(prescription_image(2), quality=90)
+        print(f"  miss             {timed(cache.lookup, other):8.3f}")
+
+        print("\nVariants of a cached image")
+        variants = {
+            "identical bytes": data,
+            "JPEG quality 50": encode(original, quality=50),
+            "PNG re-encode": encode(original, "PNG"),
+            "resized to 50%": encode(original.resize((600, 800)), quality=85),
+            "greyscale": encode(original.convert("L"), quality=85),
+            "cropped 10%": encode(original.crop((0, 0, 1200, 1440)), quality=85),
+            "one line changed": encode(with_changed_line(original), quality=90),
+            "different page": other
+        }
+        for name, variant in variants.items():
+            cache.memory.clear()
+            print(f"  {name:<16} {cache.lookup(variant)[1]}")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PrescriptionCache(cache_dir, max_entries=8, max_disk_bytes=4096)
+        for seed in range(200):
+            page = encode(prescription_image(seed, size=(240, 320)), quality=80)
+            _, _, key = cache.lookup(page)
+            cache.store(key, dict(result, seed=seed))
+        stats = cache.stats()
+        print(f"\nDisk tier after 200 stores with a 4 KB cap: {stats['entriesOnDisk']} entries, "
+              f"{stats['diskBytes']} bytes, {stats['evictions']} evictions, {stats['perceptualHits']} perceptual hits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# Benchmark of admission control overhead per request
+# Run with: python bench_rate_limit.py
+
+import os
+import tempfile
+import time
+
+from rate_limit import AdmissionController, LocalBackend, SharedMemoryBackend
+
+ITERATIONS = 200000
+CLIENTS = 1000
+
+CLASSES = {"upload": {"rate": 1e9, "burst": 1e9, "concurrency": 1000}}
+
+
+def bench(name, backend):
+    controller = AdmissionController(backend, CLASSES, {})
+    clients = [f"client-{i}" for i in range(CLIENTS)]
+
+    started = time.perf_counter()
+    for i in range(ITERATIONS):
+        if controller.check("upload", clients[i % CLIENTS]) is None:
+            controller.release("upload")
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:>14}: {elapsed / ITERATIONS * 1e6:.2f} us per request (check + release)")
+
+
+if __name__ == "__main__":
+    bench("local", LocalBackend())
+
+    path = os.path.join(tempfile.gettempdir(), f"bench-limits-{os.getpid()}")
+    try:
+        bench("shared memory", SharedMemoryBackend(path))
+    finally:
+        os.remove(path)
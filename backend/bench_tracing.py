@@ -0,0 +1,38 @@
+# Benchmark of tracing overhead
+# Times a request-shaped workload (a root span with six stage spans) with tracing off,
+# with tail sampling (every request recorded, only slow ones kept) and with every
+# request head sampled and kept.
+# Run with: python bench_tracing.py
+
+import time
+
+from tracing import Tracer, span
+
+ITERATIONS = 100000
+STAGES = ["parse", "datastore_lookup", "knowledge_join", "inference", "file_save", "serialize"]
+
+
+def handle_request(tracer):
+    root = tracer.start("POST /api/analyze-report")
+    if root is not None:
+        root.__enter__()
+    for stage in STAGES:
+        with span(stage, stage=stage):
+            pass
+    if root is not None:
+        root.__exit__(None, None, None)
+        tracer.finish(root)
+
+
+def bench(name, tracer):
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        handle_request(tracer)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>24}: {elapsed / ITERATIONS * 1e6:6.2f} us per request ({len(STAGES)} spans), kept {tracer.metrics['kept']}")
+
+
+if __name__ == "__main__":
+    bench("off", Tracer())
+    bench("tail sampling (100 ms)", Tracer(slow_threshold_ms=100))
+    bench("head sampling 100%", Tracer(sample_rate=1.0))
@@ -0,0 +1,49 @@
+# Compile knowledge base sources into memory-mapped store files
+# The server compiles data/medical_knowledge.json and data/medications.json on start-up
+# when their compiled files are missing or stale; use this to build them ahead of time
+# (e.g. in a deploy step) or to compile other sources.
+# Run with: python build_knowledge.py [source [output]] [--search-fields name,description] [--key-column id]
+
+import argparse
+import os
+import time
+
+from knowledge_store import KnowledgeStore, build, read_source
+
+# Sources the server loads, with their searchable fields
+DEFAULT_SOURCES = {
+    "data/medical_knowledge.json": ("name", "description"),
+    "data/medications.json": ()
+}
+
+
+def compile_source(source, output, search_fields, key_column=None):
+    started = time.perf_counter()
+    records = read_source(source, key_column)
+    build(records, output, search_fields)
+    store = KnowledgeStore(output)
+    print(f"{source} -> {output}: {len(store)} records, {os.path.getsize(output)} bytes, "
+          f"digest {store.digest[:12]} in {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile JSON/CSV knowledge sources into .akb store files")
+    parser.add_argument("source", nargs="?", help="JSON object keyed by record key, or CSV (default: the server's sources)")
+    parser.add_argument("output", nargs="?", help="Output file (default: source path with .akb extension)")
+    parser.add_argument("--search-fields", default="", help="Comma-separated record fields to index for search")
+    parser.add_argument("--key-column", help="Key column for CSV sources")
+    args = parser.parse_args()
+
+    if args.source is None:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        for source, search_fields in DEFAULT_SOURCES.items():
+            compile_source(source, os.path.splitext(source)[0] + ".akb", search_fields)
+        return
+
+    search_fields = tuple(name for name in args.search_fields.split(",") if name)
+    output = args.output or os.path.splitext(args.source)[0] + ".akb"
+    compile_source(args.source, output, search_fields, args.key_column)
+
+
+if __name__ == "__main__":
+    main()
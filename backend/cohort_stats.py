@@ -0,0 +1,335 @@
+# Cohort analytics over the patient datastore
+# Columns are kept as compact numpy arrays and every low-cardinality column gets a
+# packed bitmap per distinct value, so a cohort query is a handful of bitwise ORs/ANDs
+# over ~n/8 bytes instead of a pandas groupby per request. Statistics are read off the
+# cohort bitmap without gathering row indices: counts and value distributions are
+# popcounts, and since rows are stored sorted by billing amount, a billing percentile is
+# the row holding the k-th set bit, found from cumulative popcounts of the bitmap words.
+
+import numpy as np
+
+# Number of set bits for every possible byte value, used to count packed bitmaps on
+# numpy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Columns that can be filtered by value, keyed by their API parameter name
+CATEGORICAL_COLUMNS = {
+    "gender": "Gender",
+    "bloodType": "Blood Type",
+    "disease": "Disease",
+    "medication": "Medication"
+}
+
+# Columns with more distinct values than this are filtered with np.isin instead of
+# bitmaps, so a high-cardinality column cannot blow up index memory
+MAX_BITMAP_CARDINALITY = 256
+
+# Largest number of cells in the billing cube (see CohortIndex._build_billing_cube)
+MAX_CUBE_CELLS = 1 << 20
+
+BILLING_PERCENTILES = [25, 50, 75, 90, 99]
+
+
+def _compact(values):
+    """Downcast an integer column to the smallest dtype that holds its range"""
+    values = np.asarray(values)
+    if values.size == 0:
+        return values.astype(np.int8)
+    low, high = int(values.min()), int(values.max())
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def _word_popcounts(mask):
+    """Set bits in each 64-bit word of a packed bitmap"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(mask.view(np.uint64))
+    return _POPCOUNT[mask].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def _pack(flags):
+    """Pack a boolean array into a bitmap padded to whole 64-bit words"""
+    packed = np.packbits(flags)
+    padding = -len(packed) % 8
+    if padding:
+        packed = np.concatenate([packed, np.zeros(padding, dtype=np.uint8)])
+    return packed
+
+
+def parse_filter_values(raw, mapping=None):
+    """
+    Parse a comma separated filter parameter into a list of integer codes
+
+    Values may be numeric codes or, when a mapping is given, case-insensitive labels
+    (e.g. "Diabetes" or "O-"). Raises ValueError for anything unrecognised.
+    """
+    labels = {}
+    if mapping:
+        labels = {str(label).lower(): code for code, label in mapping.items()}
+
+    codes = []
+    for value in raw.split(","):
+        value = value.strip()
+        if not value:
+            continue
+        if value.lower() in labels:
+            codes.append(labels[value.lower()])
+            continue
+        try:
+            codes.append(int(value))
+        except ValueError:
+            raise ValueError(f"Unknown value '{value}'")
+    return codes
+
+
+class CohortIndex:
+    def __init__(self, columns):
+        """
+        Build the index from a dict of equally sized column arrays
+
+        Parameters:
+        columns (dict): Must contain 'Age', 'Billing Amount' and every column in CATEGORICAL_COLUMNS
+        """
+        billing = np.asarray(columns["Billing Amount"], dtype=np.float64)
+        order = np.argsort(billing, kind="stable")
+
+        self.num_rows = len(billing)
+        self.billing = billing[order]
+        self.age = _compact(np.asarray(columns["Age"])[order])
+
+        self.columns = {}
+        self.bitmaps = {}
+        for name, column in CATEGORICAL_COLUMNS.items():
+            values = _compact(np.asarray(columns[column])[order])
+            self.columns[name] = values
+
+            distinct = np.unique(values)
+            if len(distinct) <= MAX_BITMAP_CARDINALITY:
+                self.bitmaps[name] = {
+                    int(value): _pack(values == value)
+                    for value in distinct
+                }
+
+        self._build_billing_cube()
+
+        # The unfiltered cohort is the most common dashboard query, answer it from memory
+        self._all_rows_stats = self._stats(None)
+
+    def _build_billing_cube(self):
+        """
+        Billing totals for every combination of age and bitmapped column values. Any
+        cohort's billing total is then the sum of a sub-box of the cube, whatever the
+        filters, without touching the rows. Skipped when the cube would be too large.
+        """
+        self.cube_axes = None
+        self.billing_cube = None
+        if not self.num_rows:
+            return
+        low = int(self.age.min())
+        ages = np.flatnonzero(np.bincount(self.age.astype(np.int64) - low)) + low
+        axes = {"age": ages}
+        for name, bitmaps in self.bitmaps.items():
+            axes[name] = np.array(sorted(bitmaps))
+        shape = tuple(len(values) for values in axes.values())
+        cell_count = int(np.prod(shape, dtype=np.int64))
+        if cell_count > MAX_CUBE_CELLS:
+            return
+
+        cells = np.zeros(self.num_rows, dtype=np.int64)
+        for name, values in axes.items():
+            column = self.age if name == "age" else self.columns[name]
+            cells *= len(values)
+            cells += np.searchsorted(values, column)
+        self.billing_cube = np.bincount(cells, weights=self.billing, minlength=cell_count).reshape(shape)
+        self.cube_axes = axes
+
+    def _value_mask(self, name, codes):
+        """Packed bitmap of rows whose column `name` takes any of `codes`"""
+        if name in self.bitmaps:
+            mask = np.zeros(-(-self.num_rows // 64) * 8, dtype=np.uint8)
+            for code in codes:
+                bitmap = self.bitmaps[name].get(code)
+                if bitmap is not None:
+                    mask |= bitmap
+            return mask
+        return _pack(np.isin(self.columns[name], codes))
+
+    def _age_in_range(self, min_age, max_age):
+        if self.age.dtype == np.int8 and self.num_rows and self.age.min() >= 0:
+            # Ages 0-127: a single wrapping unsigned subtract and compare, since ages
+            # below the range wrap around to values above its width
+            low = 0 if min_age is None else max(0, min_age)
+            high = 255 if max_age is None else min(255, max_age)
+            if high < low:
+                return np.zeros(self.num_rows, dtype=bool)
+            shifted = np.subtract(self.age.view(np.uint8), np.uint8(low))
+            return np.less_equal(shifted, np.uint8(high - low), out=shifted.view(bool))
+
+        in_range = np.ones(self.num_rows, dtype=bool)
+        if min_age is not None:
+            in_range &= self.age >= min_age
+        if max_age is not None:
+            in_range &= self.age <= max_age
+        return in_range
+
+    def select(self, min_age=None, max_age=None, **filters):
+        """
+        Intersect all filter predicates into a single packed bitmap
+
+        Returns None when no filter is set, meaning every row is selected.
+        """
+        mask = None
+
+        if min_age is not None or max_age is not None:
+            mask = _pack(self._age_in_range(min_age, max_age))
+
+        for name, codes in filters.items():
+            if name not in self.columns:
+                raise ValueError(f"Unknown filter '{name}'")
+            if codes is None:
+                continue
+            value_mask = self._value_mask(name, codes)
+            mask = value_mask if mask is None else mask & value_mask
+
+        return mask
+
+    def count(self, mask):
+        if mask is None:
+            return self.num_rows
+        return int(_word_popcounts(mask).sum(dtype=np.int64))
+
+    def _distribution(self, name, mask):
+        column = self.columns[name]
+        if mask is None:
+            if name in self.bitmaps and min(self.bitmaps[name]) >= 0:
+                # Codes are small non-negative integers, so bincount needs no offset pass
+                counts = np.bincount(column, minlength=max(self.bitmaps[name]) + 1)
+                return {int(code): int(count) for code, count in enumerate(counts) if count}
+            codes, counts = np.unique(column, return_counts=True)
+            return {int(code): int(count) for code, count in zip(codes, counts)}
+
+        if name in self.bitmaps:
+            # One AND and popcount per value instead of gathering the cohort's rows
+            distribution = {}
+            scratch = np.empty_like(mask)
+            for code, bitmap in self.bitmaps[name].items():
+                count = self.count(np.bitwise_and(mask, bitmap, out=scratch))
+                if count:
+                    distribution[code] = count
+            return distribution
+
+        codes, counts = np.unique(column[self.rows(mask)], return_counts=True)
+        return {int(code): int(count) for code, count in zip(codes, counts)}
+
+    def _billing_total(self, mask, min_age, max_age, filters):
+        """Billing total of the cohort"""
+        if self.billing_cube is not None and all(name in self.cube_axes for name in filters):
+            selections = []
+            for name, values in self.cube_axes.items():
+                if name == "age":
+                    selected = np.ones(len(values), dtype=bool)
+                    if min_age is not None:
+                        selected &= values >= min_age
+                    if max_age is not None:
+                        selected &= values <= max_age
+                elif name in filters:
+                    selected = np.isin(values, filters[name])
+                else:
+                    selected = np.ones(len(values), dtype=bool)
+                selections.append(selected)
+            return float(self.billing_cube[np.ix_(*selections)].sum())
+
+        # One pass over the bits, 64 rows at a time, with no row gather
+        full_words = self.num_rows // 64
+        bits = np.unpackbits(mask[:full_words * 8]).reshape(full_words, 64)
+        total = float(np.einsum("ij,ij->", bits, self.billing[:full_words * 64].reshape(full_words, 64)))
+        if self.num_rows % 64:
+            tail = np.unpackbits(mask[full_words * 8:], count=self.num_rows % 64).view(bool)
+            total += float(self.billing[full_words * 64:][tail].sum())
+        return total
+
+    def _select_ranks(self, mask, ranks):
+        """Row positions of the set bits with the given 0-based ranks"""
+        popcounts = _word_popcounts(mask).astype(np.int64)
+        cumulative = np.cumsum(popcounts)
+        words = np.searchsorted(cumulative, ranks, side="right")
+        within = ranks - (cumulative[words] - popcounts[words])
+        # Unpack only the words holding the wanted bits and find the bit in each
+        bits = np.unpackbits(mask.reshape(-1, 8)[words], axis=1)
+        offsets = np.argmax(np.cumsum(bits, axis=1) > within[:, None], axis=1)
+        return words * 64 + offsets
+
+    def query(self, min_age=None, max_age=None, **filters):
+        """
+        Compute cohort statistics for the rows matching every filter
+
+        Parameters:
+        min_age, max_age (int): Inclusive age bounds, either may be None
+        filters: Lists of integer codes keyed by CATEGORICAL_COLUMNS names
+
+        Returns:
+        dict: Row count, billing summary and per-column value distributions
+        """
+        mask = self.select(min_age=min_age, max_age=max_age, **filters)
+        if mask is None:
+            return self._all_rows_stats
+
+        filters = {name: codes for name, codes in filters.items() if codes is not None}
+        return self._stats(mask, lambda: self._billing_total(mask, min_age, max_age, filters))
+
+    def rows(self, mask):
+        """Ascending row positions set in a packed bitmap"""
+        words = mask.view(np.uint64)
+        nonzero_words = np.flatnonzero(words)
+
+        # Sparse cohorts only unpack the 64-bit words that have any bit set
+        if len(nonzero_words) < len(words) // 8:
+            bits = np.unpackbits(mask.reshape(-1, 8)[nonzero_words], axis=1)
+            word_rows, bit_offsets = np.nonzero(bits)
+            return nonzero_words[word_rows] * 64 + bit_offsets
+
+        return np.flatnonzero(np.unpackbits(mask, count=self.num_rows).view(bool))
+
+    def _stats(self, mask, billing_total=None):
+        """
+        Statistics of the rows set in mask (every row if mask is None); billing_total
+        computes the cohort's billing total when given
+        """
+        count = self.count(mask)
+        billing_stats = None
+        if count:
+            # Rows are sorted by billing, so the value at rank k of the cohort is the
+            # billing of the row holding its k-th set bit
+            positions = np.array(BILLING_PERCENTILES, dtype=np.float64) / 100 * (count - 1)
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.minimum(lower + 1, count - 1)
+            weight = positions - lower
+            ranks = np.concatenate([[0, count - 1], lower, upper])
+            if mask is None:
+                values = self.billing[ranks]
+                total = float(self.billing.sum())
+            else:
+                values = self.billing[self._select_ranks(mask, ranks)]
+                total = billing_total()
+            low, high = values[2:2 + len(lower)], values[2 + len(lower):]
+            percentiles = low * (1 - weight) + high * weight
+            billing_stats = {
+                "total": round(total, 2),
+                "mean": round(total / count, 2),
+                "min": float(values[0]),
+                "max": float(values[1]),
+                "percentiles": {
+                    f"p{p}": round(float(value), 2)
+                    for p, value in zip(BILLING_PERCENTILES, percentiles)
+                }
+            }
+
+        return {
+            "count": count,
+            "billing": billing_stats,
+            "medication": self._distribution("medication", mask),
+            "disease": self._distribution("disease", mask)
+        }
@@ -0,0 +1,370 @@
+# Dedup cache for prescription image analysis
+# Results are keyed by the SHA-256 of the analyzer version and the uploaded bytes, plus a
+# perceptual hash (dHash) of the decoded image. Exact re-uploads hit on the content hash
+# without decoding. Near-duplicate matching is off by default: a 9x8 dHash cannot see
+# page text, so two prescriptions on the same letterhead can hash alike. When enabled, a
+# cached image whose dHash is within a small Hamming distance is only a candidate, and is
+# reused only if a 256x256 comparison of the two images finds no region that differs.
+# A bounded in-memory LRU sits in front of a disk tier that is shared by every worker
+# process and evicted oldest-first by total size.
+
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# dHash grid: 9x8 grey pixels give 8x8 horizontal gradient bits
+HASH_SIZE = 8
+
+# Near-duplicate candidates are compared as grey thumbnails in small blocks, so a change
+# to a single line of text (a dose, a name) stands out in the blocks that hold it, while
+# recompressed, re-encoded or moderately resized copies stay close everywhere
+VERIFY_SIZE = 256
+VERIFY_BLOCK = 8
+VERIFY_MAX_BLOCK_DIFFERENCE = 0.06
+
+# Other processes' disk entries are picked up by rescanning the directory this often
+RESCAN_INTERVAL_SECONDS = 30
+
+
+def content_hash(data, version=""):
+    # The version is hashed in, so results of an older analyzer are never returned
+    digest = hashlib.sha256(version.encode("utf-8") + b"\0") if version else hashlib.sha256()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def image_fingerprint(data, thumbnail=False):
+    """
+    64-bit difference hash of an image and, optionally, its verification thumbnail
+
+    Returns:
+    tuple: (hash, VERIFY_SIZE x VERIFY_SIZE uint8 array or None), or (None, None) if the
+    bytes are not a decodable image
+    """
+    size = VERIFY_SIZE if thumbnail else HASH_SIZE
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Lets JPEG decode at a reduced scale; only small thumbnails are needed
+        image.draft("L", (size * 2, size * 2) if thumbnail else (size * 8, size * 8))
+        image = image.convert("L")
+        small = image.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        verify = np.asarray(image.resize((VERIFY_SIZE, VERIFY_SIZE), Image.LANCZOS)) if thumbnail else None
+    except Exception:
+        return None, None
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big"), verify
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def thumbnails_match(a, b):
+    """
+    Whether two verification thumbnails show the same page
+
+    Both are normalised to zero mean and unit variance, so brightness and contrast
+    changes from re-encoding don't count; the largest mean difference over any block
+    must stay within VERIFY_MAX_BLOCK_DIFFERENCE.
+    """
+    blocks = VERIFY_SIZE // VERIFY_BLOCK
+    normalised = []
+    for thumbnail in (a, b):
+        pixels = thumbnail.astype(np.float32)
+        normalised.append((pixels - pixels.mean()) / (pixels.std() + 1e-6))
+    difference = np.abs(normalised[0] - normalised[1])
+    block_means = difference.reshape(blocks, VERIFY_BLOCK, blocks, VERIFY_BLOCK).mean(axis=(1, 3))
+    return float(block_means.max()) <= VERIFY_MAX_BLOCK_DIFFERENCE
+
+
+def _encode_thumbnail(thumbnail):
+    buffer = io.BytesIO()
+    Image.fromarray(thumbnail).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _decode_thumbnail(encoded):
+    try:
+        return np.asarray(Image.open(io.BytesIO(base64.b64decode(encoded))).convert("L"))
+    except Exception:
+        return None
+
+
+class PrescriptionCache:
+    def __init__(self, cache_dir=None, max_entries=1024, max_disk_bytes=256 * 1024 * 1024, max_distance=0,
+                 version=""):
+        """
+        Parameters:
+        cache_dir (str): Directory for the disk tier; None keeps the cache in memory only
+        max_entries (int): Results held in memory
+        max_disk_bytes (int): Size cap for the disk tier
+        max_distance (int): Largest dHash Hamming distance (of 64 bits) at which a cached
+            image is compared with the upload; 0 only matches exact copies
+        version (str): Identifies the analyzer; results stored under another version are
+            never returned
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_distance = max_distance
+        self.version = version
+
+        # sha -> (phash, result, encoded thumbnail or None), least recently used first
+        self.memory = OrderedDict()
+        # sha -> (phash, size in bytes) for files in cache_dir, least recently used first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+
+        # Multi-index hashing: with max_distance + 1 bands, a hash within max_distance of
+        # another matches it exactly in at least one band, so lookups only compare candidates
+        self._bands = self._band_slices(max_distance)
+        self._band_index = [{} for _ in self._bands]
+        self._phash_refs = {}
+
+        self._lock = threading.Lock()
+        self._next_rescan = 0
+        self.metrics = {"memoryHits": 0, "diskHits": 0, "perceptualHits": 0, "misses": 0,
+                        "stores": 0, "evictions": 0, "uncacheable": 0, "rejectedCandidates": 0}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._rescan()
+
+    @staticmethod
+    def _band_slices(max_distance):
+        bits = HASH_SIZE * HASH_SIZE
+        count = min(bits, max_distance + 1)
+        edges = [bits * i // count for i in range(count + 1)]
+        return [(edges[i], edges[i + 1] - edges[i]) for i in range(count)]
+
+    def _band_keys(self, phash):
+        return [(phash >> shift) & ((1 << width) - 1) for shift, width in self._bands]
+
+    def _index_add(self, phash, sha):
+        refs = self._phash_refs.setdefault(phash, set())
+        if not refs:
+            for index, key in zip(self._band_index, self._band_keys(phash)):
+                index.setdefault(key, set()).add(phash)
+        refs.add(sha)
+
+    def _index_remove(self, phash, sha):
+        refs = self._phash_refs.get(phash)
+        if refs is None:
+            return
+        # A sha can be in both tiers; keep it indexed while either still holds it
+        if sha in self.memory or sha in self.disk:
+            return
+        refs.discard(sha)
+        if refs:
+            return
+        del self._phash_refs[phash]
+        for index, key in zip(self._band_index, self._band_keys(phash)):
+            index[key].discard(phash)
+            if not index[key]:
+                del index[key]
+
+    def _candidates(self, phash):
+        """Indexed shas whose hash is within max_distance of phash, closest first"""
+        distances = {}
+        for index, key in zip(self._band_index, self._band_keys(phash)):
+            for candidate in index.get(key, ()):
+                if candidate not in distances:
+                    distances[candidate] = hamming_distance(phash, candidate)
+        found = []
+        for candidate, distance in sorted(distances.items(), key=lambda item: item[1]):
+            if distance <= self.max_distance:
+                found.extend(sorted(self._phash_refs[candidate]))
+        return found
+
+    def _path(self, sha, phash):
+        # The dHash is part of the name so a directory listing rebuilds the index without reading files
+        return os.path.join(self.cache_dir, f"{phash:016x}_{sha}.json")
+
+    def lookup(self, data):
+        """
+        Find a cached result for an uploaded image
+
+        Returns:
+        tuple: (result or None, status), status being "memory", "disk", "perceptual",
+        "miss" or "uncacheable", plus the (sha, phash) key to pass to store() on a miss
+        """
+        sha = content_hash(data, self.version)
+        with self._lock:
+            entry = self.memory.get(sha)
+            if entry is not None:
+                self.memory.move_to_end(sha)
+                self.metrics["memoryHits"] += 1
+                return entry[1], "memory", (sha, entry[0], None)
+            # A known disk entry already carries its dHash, so no decode is needed
+            disk_entry = self.disk.get(sha)
+            if disk_entry is not None:
+                entry = self._read_disk(sha, disk_entry[0])
+                if entry is not None:
+                    self.metrics["diskHits"] += 1
+                    return entry[0], "disk", (sha, disk_entry[0], None)
+
+        near_duplicates = self.max_distance > 0
+        phash, thumbnail = image_fingerprint(data, thumbnail=near_duplicates)
+        if phash is None:
+            with self._lock:
+                self.metrics["uncacheable"] += 1
+            return None, "uncacheable", (sha, None, None)
+
+        with self._lock:
+            self._maybe_rescan()
+            # Exact copies written by any process are found by name
+            entry = self._read_disk(sha, phash)
+            if entry is not None:
+                self.metrics["diskHits"] += 1
+                return entry[0], "disk", (sha, phash, thumbnail)
+
+            if near_duplicates:
+                for candidate in self._candidates(phash):
+                    entry = self._get(candidate)
+                    if entry is None:
+                        continue
+                    cached_thumbnail = _decode_thumbnail(entry[1]) if entry[1] else None
+                    # A dHash match alone says little about the text on the page
+                    if cached_thumbnail is not None and thumbnails_match(thumbnail, cached_thumbnail):
+                        self.metrics["perceptualHits"] += 1
+                        return entry[0], "perceptual", (sha, phash, thumbnail)
+                    self.metrics["rejectedCandidates"] += 1
+
+            self.metrics["misses"] += 1
+            return None, "miss", (sha, phash, thumbnail)
+
+    def store(self, key, result):
+        """Cache the analysis result for the image identified by a lookup() key"""
+        sha, phash, thumbnail = key
+        if phash is None:
+            return
+        encoded = _encode_thumbnail(thumbnail) if thumbnail is not None else None
+        with self._lock:
+            self._remember(sha, phash, result, encoded)
+            self.metrics["stores"] += 1
+            if self.cache_dir:
+                self._write_disk(sha, phash, result, encoded)
+
+    def _get(self, sha):
+        """(result, encoded thumbnail) for a cached sha, or None"""
+        entry = self.memory.get(sha)
+        if entry is not None:
+            self.memory.move_to_end(sha)
+            return entry[1], entry[2]
+        disk_entry = self.disk.get(sha)
+        if disk_entry is not None:
+            return self._read_disk(sha, disk_entry[0])
+        return None
+
+    def _remember(self, sha, phash, result, thumbnail):
+        self.memory[sha] = (phash, result, thumbnail)
+        self.memory.move_to_end(sha)
+        self._index_add(phash, sha)
+        while len(self.memory) > self.max_entries:
+            old_sha, (old_phash, _, _) = self.memory.popitem(last=False)
+            self._index_remove(old_phash, old_sha)
+
+    def _read_disk(self, sha, phash):
+        """(result, encoded thumbnail) from the disk tier, or None"""
+        if not self.cache_dir:
+            return None
+        path = self._path(sha, phash)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Entries of another analyzer version are only reachable as dHash candidates
+            if not isinstance(entry, dict) or entry.get("version") != self.version or "result" not in entry:
+                return None
+            # mtime records last use, so eviction in any process drops the coldest entries
+            os.utime(path)
+        except (OSError, ValueError):
+            self._forget_disk(sha)
+            return None
+        if sha not in self.disk:
+            self.disk[sha] = (phash, os.path.getsize(path))
+            self.disk_bytes += self.disk[sha][1]
+        self.disk.move_to_end(sha)
+        self._remember(sha, phash, entry["result"], entry.get("thumbnail"))
+        return entry["result"], entry.get("thumbnail")
+
+    def _write_disk(self, sha, phash, result, thumbnail):
+        path = self._path(sha, phash)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, "thumbnail": thumbnail, "result": result}, f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing prescription cache entry: {e}")
+            return
+        self._forget_disk(sha)
+        self.disk[sha] = (phash, size)
+        self.disk_bytes += size
+        self._index_add(phash, sha)
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            old_sha, (old_phash, _) = next(iter(self.disk.items()))
+            try:
+                os.remove(self._path(old_sha, old_phash))
+            except FileNotFoundError:
+                pass
+            self._forget_disk(old_sha)
+            self.metrics["evictions"] += 1
+
+    def _forget_disk(self, sha):
+        entry = self.disk.pop(sha, None)
+        if entry is not None:
+            self.disk_bytes -= entry[1]
+            self._index_remove(entry[0], sha)
+
+    def _maybe_rescan(self):
+        if self.cache_dir and time.time() >= self._next_rescan:
+            self._rescan()
+
+    def _rescan(self):
+        """Rebuild the disk index from the directory, picking up other processes' writes and evictions"""
+        self._next_rescan = time.time() + RESCAN_INTERVAL_SECONDS
+        found = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext != ".json" or "_" not in name:
+                    continue
+                phash_hex, sha = name.split("_", 1)
+                try:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, sha, int(phash_hex, 16), stat.st_size))
+                except (OSError, ValueError):
+                    continue
+
+        for sha in list(self.disk):
+            self._forget_disk(sha)
+        for _, sha, phash, size in sorted(found):
+            self.disk[sha] = (phash, size)
+            self.disk_bytes += size
+            self._index_add(phash, sha)
+
+    def stats(self):
+        with self._lock:
+            hits = self.metrics["memoryHits"] + self.metrics["diskHits"] + self.metrics["perceptualHits"]
+            lookups = hits + self.metrics["misses"] + self.metrics["uncacheable"]
+            return {
+                "entriesInMemory": len(self.memory),
+                "maxEntries": self.max_entries,
+                "entriesOnDisk": len(self.disk),
+                "diskBytes": self.disk_bytes,
+                "maxDiskBytes": self.max_disk_bytes,
+                "maxDistance": self.max_distance,
+                "lookups": lookups,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+                **self.metrics
+            }
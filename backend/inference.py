@@ -0,0 +1,183 @@
+# CPU inference backends for the optional transformer models
+# The symptom classifier and the chat model can run as:
+#   eager       full precision PyTorch pipeline (the original plan)
+#   torch-int8  PyTorch with dynamic int8 quantization of every Linear layer
+#   onnx-int8   exported to ONNX, dynamically quantized to int8 and run on ONNX Runtime;
+#               the quantized graph is cached on disk and reused on later starts
+# Models are built lazily on first use in each process, so a pre-fork master never starts
+# inference thread pools that would not survive fork(); expensive one-off work (export and
+# quantization) can still be done up front with prepare().
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+BACKENDS = ("eager", "torch-int8", "onnx-int8")
+
+# transformers / optimum model classes per pipeline task
+TASK_MODEL_CLASSES = {
+    "text-classification": ("AutoModelForSequenceClassification", "ORTModelForSequenceClassification"),
+    "text-generation": ("AutoModelForCausalLM", "ORTModelForCausalLM")
+}
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+
+def default_thread_counts():
+    """
+    Intra/inter-op thread counts for this process
+
+    INFERENCE_INTRA_OP_THREADS / INFERENCE_INTER_OP_THREADS override the defaults; the
+    pre-fork launcher sets the intra-op default to CPUs divided by the number of workers
+    so workers don't oversubscribe the machine.
+    """
+    intra = int(os.environ.get("INFERENCE_INTRA_OP_THREADS", 0)) or os.cpu_count() or 1
+    inter = int(os.environ.get("INFERENCE_INTER_OP_THREADS", 0)) or 1
+    return intra, inter
+
+
+def _build_onnx_artifact(task, model_id, artifact_dir):
+    """Export a model to ONNX and quantize it to int8 into artifact_dir (runs in a child process)"""
+    import optimum.onnxruntime as ort_models
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    model_class = getattr(ort_models, TASK_MODEL_CLASSES[task][1])
+    # Each build stages into its own directory, so processes building the same model at
+    # once (e.g. prefork workers without preloading) never write into each other's files
+    staging_dir = tempfile.mkdtemp(prefix=os.path.basename(artifact_dir) + ".", suffix=".tmp",
+                                   dir=os.path.dirname(artifact_dir) or ".")
+    try:
+        model = model_class.from_pretrained(model_id, export=True)
+        model.save_pretrained(staging_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(staging_dir)
+
+        # Dynamic quantization: int8 weights, activation scales computed at run time, so no
+        # calibration data is needed
+        quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        onnx_files = [name for name in os.listdir(staging_dir) if name.endswith(".onnx")]
+        for file_name in onnx_files:
+            quantizer = ORTQuantizer.from_pretrained(staging_dir, file_name=file_name)
+            quantizer.quantize(save_dir=staging_dir, quantization_config=quantization_config)
+        for file_name in onnx_files:
+            os.remove(os.path.join(staging_dir, file_name))
+
+        # Publish atomically so concurrent starts never see a half-written artifact
+        try:
+            os.rename(staging_dir, artifact_dir)
+        except OSError:
+            # Another process published the same artifact first; theirs is just as good
+            if not os.path.isdir(artifact_dir):
+                raise
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+class InferenceModel:
+    def __init__(self, task, model_id, backend="eager", cache_dir="model_cache",
+                 intra_op_threads=None, inter_op_threads=None):
+        """
+        Parameters:
+        task (str): "text-classification" or "text-generation"
+        model_id (str): Hugging Face model ID or local model directory
+        backend (str): One of BACKENDS
+        cache_dir (str): Where compiled ONNX artifacts are kept
+        intra_op_threads, inter_op_threads (int): Defaults from default_thread_counts()
+        """
+        if task not in TASK_MODEL_CLASSES:
+            raise ValueError(f"Unsupported task '{task}'")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+        default_intra, default_inter = default_thread_counts()
+        self.task = task
+        self.model_id = model_id
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.intra_op_threads = intra_op_threads or default_intra
+        self.inter_op_threads = inter_op_threads or default_inter
+
+        self._pipeline = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def artifact_dir(self):
+        """Cache directory for this model's compiled artifact, keyed by model, task and source version"""
+        key = {"model": self.model_id, "task": self.task, "backend": self.backend}
+        config_path = os.path.join(self.model_id, "config.json")
+        if os.path.exists(config_path):
+            # Local models are re-exported when they change
+            key["mtime"] = os.path.getmtime(config_path)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        name = os.path.basename(os.path.normpath(self.model_id)).replace("/", "_")
+        return os.path.join(self.cache_dir, f"{name}-{self.task}-{digest}")
+
+    def prepare(self):
+        """
+        Build the on-disk artifact if the backend needs one and it is not cached yet
+
+        The export runs in a spawned child process, so calling this in a pre-fork master
+        leaves no PyTorch or ONNX Runtime thread pools behind in the master.
+        """
+        if self.backend != "onnx-int8" or os.path.isdir(self.artifact_dir):
+            return
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pool.submit(_build_onnx_artifact, self.task, self.model_id, self.artifact_dir).result()
+
+    def _load(self):
+        from transformers import AutoTokenizer, pipeline
+
+        if self.backend == "onnx-int8":
+            import onnxruntime
+            import optimum.onnxruntime as ort_models
+
+            self.prepare()
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads
+            options.inter_op_num_threads = self.inter_op_threads
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            model_class = getattr(ort_models, TASK_MODEL_CLASSES[self.task][1])
+            model = model_class.from_pretrained(
+                self.artifact_dir,
+                file_name=QUANTIZED_FILE_NAME,
+                session_options=options,
+                provider="CPUExecutionProvider"
+            )
+            tokenizer = AutoTokenizer.from_pretrained(self.artifact_dir)
+            return pipeline(self.task, model=model, tokenizer=tokenizer)
+
+        import torch
+        import transformers
+
+        torch.set_num_threads(self.intra_op_threads)
+        try:
+            torch.set_num_interop_threads(self.inter_op_threads)
+        except RuntimeError:
+            # Can only be set once per process, before any inter-op work has run
+            pass
+
+        model_class = getattr(transformers, TASK_MODEL_CLASSES[self.task][0])
+        model = model_class.from_pretrained(self.model_id, torch_dtype=torch.float32)
+        model.eval()
+        if self.backend == "torch-int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        return pipeline(self.task, model=model, tokenizer=tokenizer, device=-1)
+
+    def __call__(self, inputs, **kwargs):
+        # A pipeline inherited across fork() has unusable thread pools, so rebuild it per process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pipeline = self._load()
+                    self._pid = os.getpid()
+        return self._pipeline(inputs, **kwargs)
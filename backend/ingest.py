@@ -0,0 +1,248 @@
+# Parallel ingestion of the patient datastore from CSV shards
+# Patient data arrives as many CSV files with the datastore1.csv schema. Each shard is
+# parsed and aggregated independently in a worker process (map): disease contingency
+# tables, billing sums and counts, and the compact columns the cohort index needs. The
+# parent merges those small partial results as they arrive (reduce), so only aggregates
+# and int/float arrays cross process boundaries, never DataFrames.
+#
+# Rows with missing, non-numeric, negative, fractional or out-of-range codes, or the wrong
+# number of fields, are counted per shard and skipped. A shard that cannot be read or lacks a
+# required column is reported and skipped without failing the others.
+
+import glob
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from cohort_stats import CATEGORICAL_COLUMNS
+
+CODE_COLUMNS = ["Age", "Gender", "Disease", "Blood Type", "Medication", "Test Result", "Age_Bin"]
+# Codes are stored as int32; larger values would wrap around
+MAX_CODE = np.iinfo(np.int32).max
+REQUIRED_COLUMNS = CODE_COLUMNS + ["Billing Amount"]
+
+# Columns cross-tabulated against Disease
+CROSSTAB_COLUMNS = ["Age_Bin", "Gender", "Blood Type", "Test Result", "Medication"]
+
+# Columns kept row by row for the cohort index
+INDEX_COLUMNS = ["Age", "Billing Amount"] + list(CATEGORICAL_COLUMNS.values())
+
+
+def resolve_shards(source):
+    """
+    Expand a datastore source into a sorted list of CSV files
+
+    Parameters:
+    source (str): A CSV file, a directory (every *.csv inside it) or a glob pattern
+
+    Returns:
+    list: File paths; raises FileNotFoundError when nothing matches
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "*.csv"))
+    elif glob.has_magic(source):
+        paths = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+    else:
+        paths = [source] if os.path.isfile(source) else []
+    if not paths:
+        raise FileNotFoundError(f"No datastore shards match {source}")
+    return sorted(paths)
+
+
+def aggregate_shard(path):
+    """
+    Parse one shard and aggregate it (runs in a worker process)
+
+    Returns:
+    dict: Shard report (path, rows, malformedRows, seconds, error) plus the partial
+    aggregates under "crosstabs", "billing" and "columns"
+    """
+    started = time.perf_counter()
+    report = {"path": path, "rows": 0, "malformedRows": 0, "seconds": 0.0, "error": None}
+    try:
+        # The parser drops lines with too many fields and reports each one ("Skipping line N")
+        # in a warning; counting those, not newlines, keeps quoted multiline fields out of it
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", pd.errors.ParserWarning)
+            frame = pd.read_csv(path, skip_blank_lines=False, on_bad_lines="warn")
+        dropped = sum(
+            str(warning.message).count("Skipping line")
+            for warning in caught if issubclass(warning.category, pd.errors.ParserWarning)
+        )
+    except Exception as e:
+        report["error"] = str(e)
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in frame.columns]
+    if missing:
+        report["error"] = f"Missing columns: {', '.join(missing)}"
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    frame = frame.dropna(how="all")[REQUIRED_COLUMNS]
+
+    valid = np.ones(len(frame), dtype=bool)
+    values = {}
+    for column in REQUIRED_COLUMNS:
+        numbers = pd.to_numeric(frame[column], errors="coerce").to_numpy(dtype=np.float64)
+        valid &= np.isfinite(numbers) & (numbers >= 0)
+        if column in CODE_COLUMNS:
+            valid &= (numbers == np.floor(numbers)) & (numbers <= MAX_CODE)
+        values[column] = numbers
+
+    rows = int(valid.sum())
+    report["rows"] = rows
+    report["malformedRows"] = dropped + len(frame) - rows
+
+    codes = {column: values[column][valid].astype(np.int32) for column in CODE_COLUMNS}
+    billing = values["Billing Amount"][valid]
+
+    # Pair counts as (disease, value) -> count, using one bincount per column
+    disease = codes["Disease"].astype(np.int64)
+    crosstabs = {}
+    for column in CROSSTAB_COLUMNS:
+        width = int(codes[column].max()) + 1 if rows else 1
+        counts = np.bincount(disease * width + codes[column])
+        crosstabs[column] = {
+            (int(pair // width), int(pair % width)): int(counts[pair])
+            for pair in np.flatnonzero(counts)
+        }
+
+    billing_sums = np.bincount(disease, weights=billing) if rows else np.zeros(0)
+    billing_counts = np.bincount(disease) if rows else np.zeros(0, dtype=np.int64)
+    report["crosstabs"] = crosstabs
+    report["billing"] = {
+        int(code): (float(billing_sums[code]), int(billing_counts[code]))
+        for code in np.flatnonzero(billing_counts)
+    }
+    report["columns"] = {column: codes[column] for column in INDEX_COLUMNS if column in codes}
+    report["columns"]["Billing Amount"] = billing
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+class DatastoreAggregates:
+    def __init__(self):
+        self.rows = 0
+        self.malformed_rows = 0
+        self.pair_counts = {column: {} for column in CROSSTAB_COLUMNS}  # column -> {(disease, value): count}
+        self.billing_sums = {}
+        self.billing_counts = {}
+        self.columns = {}
+        self.shards = []
+        self.workers = 0
+        self.seconds = 0.0
+        self._column_parts = []
+
+    def merge(self, partial):
+        """Fold one shard's partial aggregates into the totals"""
+        report = {key: partial[key] for key in ("path", "rows", "malformedRows", "seconds", "error")}
+        self.shards.append(report)
+        self.malformed_rows += report["malformedRows"]
+        if report["error"] or not report["rows"]:
+            return
+        self.rows += report["rows"]
+        for column, counts in partial["crosstabs"].items():
+            totals = self.pair_counts[column]
+            for pair, count in counts.items():
+                totals[pair] = totals.get(pair, 0) + count
+        for disease, (amount, count) in partial["billing"].items():
+            self.billing_sums[disease] = self.billing_sums.get(disease, 0.0) + amount
+            self.billing_counts[disease] = self.billing_counts.get(disease, 0) + count
+        self._column_parts.append((report["path"], partial["columns"]))
+
+    def finish(self):
+        """Concatenate the merged row columns; called once after the last merge"""
+        # Shards finish in any order; concatenate by path so row order is reproducible
+        parts = [columns for _, columns in sorted(self._column_parts, key=lambda part: part[0])]
+        self._column_parts = []
+        self.columns = {
+            column: np.concatenate([part[column] for part in parts]) if parts else np.zeros(0)
+            for column in INDEX_COLUMNS
+        }
+        self.shards.sort(key=lambda shard: shard["path"])
+
+    def crosstab(self, column):
+        """
+        Row counts by disease and value of another column
+
+        Returns:
+        dict: disease code -> {value code -> count}, both in ascending order
+        """
+        table = {}
+        for (disease, value), count in sorted(self.pair_counts[column].items()):
+            table.setdefault(disease, {})[value] = count
+        return table
+
+    def billing_means(self):
+        """Mean billing amount per disease code"""
+        return {
+            disease: self.billing_sums[disease] / self.billing_counts[disease]
+            for disease in sorted(self.billing_counts)
+        }
+
+    def summary(self):
+        return {
+            "rows": self.rows,
+            "malformedRows": self.malformed_rows,
+            "shards": len(self.shards),
+            "failedShards": sum(1 for shard in self.shards if shard["error"]),
+            "workers": self.workers,
+            "seconds": round(self.seconds, 3)
+        }
+
+
+def default_workers():
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def _pool_context():
+    # A fork server starts clean from this module, so workers neither inherit the
+    # caller's threads (model runtimes, exporters) nor re-import the whole app
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def ingest(source, workers=None):
+    """
+    Ingest every shard of a datastore source in parallel
+
+    Parameters:
+    source (str): A CSV file, a directory of CSV files or a glob pattern
+    workers (int): Worker processes (default: one per CPU, at most one per shard).
+    A single worker or a single shard is parsed in this process
+
+    Returns:
+    DatastoreAggregates
+    """
+    started = time.perf_counter()
+    paths = resolve_shards(source)
+    workers = min(workers or default_workers(), len(paths))
+    aggregates = DatastoreAggregates()
+    aggregates.workers = workers
+
+    if workers <= 1:
+        for path in paths:
+            aggregates.merge(aggregate_shard(path))
+    else:
+        # Largest shards first so a big shard at the end doesn't leave the other workers idle
+        paths_by_size = sorted(paths, key=os.path.getsize, reverse=True)
+        with ProcessPoolExecutor(workers, mp_context=_pool_context()) as pool:
+            futures = [pool.submit(aggregate_shard, path) for path in paths_by_size]
+            for future in as_completed(futures):
+                aggregates.merge(future.result())
+
+    aggregates.finish()
+    aggregates.seconds = time.perf_counter() - started
+    return aggregates
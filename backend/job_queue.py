@@ -0,0 +1,344 @@
+# Background job queue for bulk analysis
+# Jobs are persisted in SQLite and their inputs/results on the local filesystem, so a
+# queued or half-finished job survives a server restart. Each worker thread claims one
+# job at a time, processes it in chunks and appends results to an NDJSON file, committing
+# progress after every chunk. A worker holds a lease on its job, renewed by a heartbeat
+# thread; every write checks the lease is still held, so a job handed to another worker
+# after a stall is never written by two workers at once.
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# A running job whose heartbeat is older than this is assumed to belong to a dead
+# worker and is handed to the next free worker, which resumes it from its last chunk
+DEFAULT_LEASE_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    results_path TEXT NOT NULL,
+    total INTEGER,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    processing_seconds REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat REAL
+)
+"""
+
+
+class _Lease:
+    """A worker's claim on a running job: the heartbeat value it last wrote"""
+
+    def __init__(self, job_id, heartbeat):
+        self.job_id = job_id
+        self.heartbeat = heartbeat
+        self.lost = False
+        self.lock = threading.Lock()
+
+
+class JobQueue:
+    def __init__(self, storage_dir, concurrency=2, chunk_size=100, poll_interval=1.0,
+                 lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Parameters:
+        storage_dir (str): Directory holding the SQLite database and per-job files
+        concurrency (int): Number of worker threads, i.e. jobs processed at once
+        chunk_size (int): Records processed between progress commits
+        """
+        self.storage_dir = storage_dir
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.db_path = os.path.join(storage_dir, "jobs.db")
+
+        self.kinds = {}
+        self.workers = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        os.makedirs(storage_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the queue usable from any thread
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def register(self, kind, read_records, process_record, count_records=None):
+        """
+        Register a job type
+
+        Parameters:
+        read_records (callable): path -> iterator over the records of an uploaded file
+        process_record (callable): record -> JSON serializable result
+        count_records (callable): Optional path -> total number of records, for progress
+        """
+        self.kinds[kind] = {
+            "read": read_records,
+            "process": process_record,
+            "count": count_records
+        }
+
+    def submit(self, kind, upload, filename):
+        """Store an uploaded file (anything with a .save(path) method) and queue a job for it"""
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job type '{kind}'")
+
+        job_id = str(uuid.uuid4())
+        job_dir = os.path.join(self.storage_dir, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, "input" + os.path.splitext(filename)[1].lower())
+        results_path = os.path.join(job_dir, "results.ndjson")
+        try:
+            upload.save(input_path)
+            total = None
+            if self.kinds[kind]["count"] is not None:
+                try:
+                    total = self.kinds[kind]["count"](input_path)
+                except Exception as e:
+                    raise ValueError(f"Unreadable {kind} upload: {e}")
+        except BaseException:
+            # A rejected upload leaves nothing behind
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, input_path, results_path, total, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, input_path, results_path, total, datetime.now().isoformat())
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return the public status of a job, or None if it does not exist"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        throughput = None
+        if row["processing_seconds"] > 0:
+            throughput = round(row["processed"] / row["processing_seconds"], 2)
+
+        progress = None
+        if row["total"]:
+            progress = round(100 * row["processed"] / row["total"], 1)
+
+        return {
+            "jobId": row["id"],
+            "type": row["kind"],
+            "status": row["status"],
+            "total": row["total"],
+            "processed": row["processed"],
+            "failed": row["failed"],
+            "progress": progress,
+            "recordsPerSecond": throughput,
+            "processingSeconds": round(row["processing_seconds"], 3),
+            "error": row["error"],
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"]
+        }
+
+    def results_path(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT results_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["results_path"] if row else None
+
+    def start(self):
+        """Start the worker threads; must be called in the process that serves requests"""
+        if self.workers:
+            return
+        self._stop.clear()
+        for i in range(self.concurrency):
+            worker = threading.Thread(target=self._run_worker, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        print(f"Started {self.concurrency} job workers")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def _claim(self):
+        """Atomically take the oldest queued job, or a running job whose lease has expired"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND heartbeat < ?) ORDER BY created_at LIMIT 1",
+                    (now - self.lease_seconds,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', heartbeat = ?, "
+                        "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                        (now, datetime.now().isoformat(), row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["heartbeat"] = now
+        return job
+
+    def _update_owned(self, lease, assignments="", params=(), heartbeat=None):
+        """
+        Update the job only while this worker still holds its lease, moving the heartbeat on
+
+        Parameters:
+        assignments (str): Extra "column = ?, " assignments, with their params
+        heartbeat (float): New heartbeat value (default: now)
+
+        Returns:
+        bool: False if another worker has taken over the job
+        """
+        with lease.lock:
+            if lease.lost:
+                return False
+            heartbeat = time.time() if heartbeat is None else heartbeat
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    f"UPDATE jobs SET {assignments}heartbeat = ? WHERE id = ? AND heartbeat = ?",
+                    (*params, heartbeat, lease.job_id, lease.heartbeat)
+                )
+            if cursor.rowcount == 0:
+                lease.lost = True
+                print(f"Job {lease.job_id} was taken over by another worker; stopping")
+                return False
+            lease.heartbeat = heartbeat
+            return True
+
+    def _keep_alive(self, lease, done):
+        # Renew well within the lease, so a slow chunk or record never lets it expire
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self._update_owned(lease):
+                    return
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+
+    def _run_worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            lease = _Lease(job["id"], job["heartbeat"])
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._keep_alive, args=(lease, done), daemon=True)
+            heartbeat.start()
+            try:
+                self._process(job, lease)
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                self._update_owned(
+                    lease, "status = 'failed', error = ?, finished_at = ?, ",
+                    (str(e), datetime.now().isoformat())
+                )
+            finally:
+                done.set()
+                heartbeat.join()
+
+    def _process(self, job, lease):
+        kind = self.kinds[job["kind"]]
+        processed = job["processed"]
+        failed = job["failed"]
+
+        # Drop results written after the last committed chunk of an interrupted run
+        _truncate_lines(job["results_path"], processed)
+
+        records = kind["read"](job["input_path"])
+        index = 0
+        with open(job["results_path"], "a", encoding="utf-8") as results:
+            while not self._stop.is_set():
+                chunk = []
+                for record in records:
+                    if index >= processed:
+                        chunk.append((index, record))
+                    index += 1
+                    if len(chunk) == self.chunk_size:
+                        break
+                if not chunk:
+                    break
+
+                started = time.perf_counter()
+                lines = []
+                for record_index, record in chunk:
+                    try:
+                        lines.append(json.dumps({"index": record_index, "result": kind["process"](record)}))
+                    except Exception as e:
+                        failed += 1
+                        lines.append(json.dumps({"index": record_index, "error": str(e)}))
+                # Renewing the lease first guarantees nobody else can claim the job (and
+                # truncate or append to the results) while this chunk is written
+                if not self._update_owned(lease):
+                    return
+                results.write("\n".join(lines) + "\n")
+                results.flush()
+                processed += len(chunk)
+
+                if not self._update_owned(
+                        lease, "processed = ?, failed = ?, processing_seconds = processing_seconds + ?, ",
+                        (processed, failed, time.perf_counter() - started)):
+                    return
+
+        if self._stop.is_set():
+            # Leave the job running; it is resumed once its lease expires or on restart
+            self._update_owned(lease, heartbeat=0)
+            return
+
+        self._update_owned(
+            lease, "status = 'completed', total = ?, finished_at = ?, ",
+            (processed, datetime.now().isoformat())
+        )
+
+
+def _truncate_lines(path, keep):
+    """Truncate a text file to its first `keep` lines"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        for _ in range(keep):
+            if not f.readline():
+                break
+        f.truncate()
@@ -0,0 +1,217 @@
+# Read-only, memory-mapped key/value store for the knowledge base and medication formulary
+# Source data lives in data/*.json (or CSV) and is compiled by build_knowledge.py into one
+# binary file:
+#
+#   header   magic, record count, key width, SHA-256 of everything after the header
+#   index    one fixed-width entry per record, sorted by key: key (UTF-8, NUL padded),
+#            record offset/length, search text offset/length
+#   records  msgpack-encoded records
+#   search   lowercased text of the searchable fields of each record
+#
+# Opening a store maps the file and reads the header, so start-up time doesn't depend
+# on the number of records; the digest identifies the content (e.g. in cache keys) without
+# reading it. Lookups binary search the index in place and decode one
+# record; recently used records are kept decoded in a small LRU. The pages are shared
+# through the OS page cache by every worker process that maps the same file.
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import msgspec
+
+MAGIC = b"AKB2"
+HEADER = struct.Struct("<4sII32s")  # magic, record count, key width, content digest
+
+
+def _entry_struct(key_width):
+    # key, record offset, record length, search offset, search length
+    return struct.Struct(f"<{key_width}sQIQI")
+
+
+def build(records, path, search_fields=()):
+    """
+    Compile records into a store file
+
+    Parameters:
+    records (dict): Key -> record (any msgpack-serializable value)
+    path (str): Output file; written to a temporary file and renamed into place
+    search_fields (tuple): Record fields whose text search() matches against
+    """
+    encoder = msgspec.msgpack.Encoder()
+    keys = sorted(records, key=lambda key: key.encode("utf-8"))
+    encoded_keys = [key.encode("utf-8") for key in keys]
+    key_width = max((len(key) for key in encoded_keys), default=1)
+    entry = _entry_struct(key_width)
+
+    index_size = HEADER.size + entry.size * len(keys)
+    blobs = [encoder.encode(records[key]) for key in keys]
+    search_texts = [
+        "\n".join(str(records[key].get(name, "")) for name in search_fields).lower().encode("utf-8")
+        if search_fields and isinstance(records[key], dict) else b""
+        for key in keys
+    ]
+
+    digest = hashlib.sha256()
+
+    def write(data):
+        digest.update(data)
+        f.write(data)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        # The digest covers the sections that follow, so the header is filled in last
+        f.write(b"\0" * HEADER.size)
+        record_offset = index_size
+        search_offset = index_size + sum(len(blob) for blob in blobs)
+        for key, blob, text in zip(encoded_keys, blobs, search_texts):
+            write(entry.pack(key, record_offset, len(blob), search_offset, len(text)))
+            record_offset += len(blob)
+            search_offset += len(text)
+        for blob in blobs:
+            write(blob)
+        for text in search_texts:
+            write(text)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(keys), key_width, digest.digest()))
+    os.replace(temp_path, path)
+
+
+def read_source(path, key_field=None):
+    """
+    Load source records from JSON (an object keyed by record key) or CSV (one record per
+    row, keyed by key_field)
+    """
+    if path.lower().endswith(".csv"):
+        import csv
+        if not key_field:
+            raise ValueError("CSV sources need a key column")
+        with open(path, newline="", encoding="utf-8") as f:
+            return {row[key_field]: row for row in csv.DictReader(f)}
+    with open(path, encoding="utf-8") as f:
+        records = json.load(f)
+    if not isinstance(records, dict):
+        raise ValueError(f"{path} must contain a JSON object keyed by record key")
+    return records
+
+
+class KnowledgeStore(Mapping):
+    def __init__(self, path, cache_size=256):
+        """
+        Parameters:
+        path (str): Compiled store file
+        cache_size (int): Decoded records kept in memory
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a knowledge store file")
+        magic, self._count, key_width, digest = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a knowledge store file")
+        # SHA-256 of the store's content, written by build()
+        self.digest = digest.hex()
+        self._key_width = key_width
+        self._entry = _entry_struct(key_width)
+        self._view = memoryview(self._map)
+        self._decoder = msgspec.msgpack.Decoder()
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read_entry(self, position):
+        return self._entry.unpack_from(self._map, HEADER.size + position * self._entry.size)
+
+    def _find(self, key):
+        """Index entry for key, or None"""
+        if not isinstance(key, str):
+            return None
+        target = key.encode("utf-8")
+        if len(target) > self._key_width:
+            return None
+        # NUL padding sorts first, so padded keys compare in the same order as the keys
+        target = target.ljust(self._key_width, b"\0")
+        data, entry_size, width = self._map, self._entry.size, self._key_width
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            start = HEADER.size + middle * entry_size
+            stored = data[start:start + width]
+            if stored == target:
+                return self._read_entry(middle)
+            if stored < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __getitem__(self, key):
+        with self._lock:
+            record = self._cache.get(key)
+            if record is not None:
+                self._cache.move_to_end(key)
+                return record
+
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        _, offset, length, _, _ = entry
+        record = self._decoder.decode(self._view[offset:offset + length])
+
+        with self._lock:
+            self._cache[key] = record
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    def __contains__(self, key):
+        # Answered from the index without decoding the record
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Keys in sorted order"""
+        for position in range(self._count):
+            yield self._read_entry(position)[0].rstrip(b"\0").decode("utf-8")
+
+    def search(self, query):
+        """Keys (sorted) whose key or searchable text contains query, case-insensitively"""
+        query = query.lower()
+        encoded = query.encode("utf-8")
+        for position in range(self._count):
+            key, _, _, search_offset, search_length = self._read_entry(position)
+            key = key.rstrip(b"\0")
+            if encoded in key or encoded in self._map[search_offset:search_offset + search_length]:
+                yield key.decode("utf-8")
+
+
+def open_store(source_path, compiled_path=None, search_fields=(), key_field=None, cache_size=256):
+    """
+    Open the compiled store for a source file, compiling it first if it is missing,
+    older than the source, or not a valid store
+
+    Returns:
+    KnowledgeStore
+    """
+    compiled_path = compiled_path or os.path.splitext(source_path)[0] + ".akb"
+    stale = (
+        not os.path.exists(compiled_path)
+        or (os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(compiled_path))
+    )
+    if not stale:
+        try:
+            return KnowledgeStore(compiled_path, cache_size)
+        except (OSError, ValueError, struct.error):
+            pass
+    build(read_source(source_path, key_field), compiled_path, search_fields)
+    print(f"Compiled {source_path} into {compiled_path}")
+    return KnowledgeStore(compiled_path, cache_size)
@@ -0,0 +1,403 @@
+# Real-time population statistics over incoming traffic
+# Every analysed report is folded into bounded-memory sketches:
+#   count-min sketch  counts of categorical values and of every pair of them
+#                     (e.g. age bin x high risk), never under-estimated
+#   t-digest          distributions of numeric values (health score, billing amount)
+#   HyperLogLog       distinct clients
+# Sketches live in a ring of time buckets (e.g. 60 x 1 minute), all allocated up front,
+# so memory is fixed no matter how much traffic arrives; a query merges the buckets in
+# its window. All three sketches merge losslessly, so each worker process writes its ring
+# to a spool directory from a background thread, and queries merge every worker's latest
+# snapshot.
+
+import hashlib
+import math
+import os
+import threading
+import time
+from functools import lru_cache
+from itertools import combinations
+
+import msgspec
+import numpy as np
+
+# Workers publish their snapshot this often while new records arrive, which bounds how far
+# behind other workers' view of this one can be
+SPOOL_INTERVAL_SECONDS = 1
+
+
+@lru_cache(maxsize=65536)
+def _hash128(key):
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+@lru_cache(maxsize=65536)
+def _cells(key, width, depth):
+    # Double hashing gives `depth` row positions from one 128-bit hash
+    h1, h2 = _hash128(key)
+    return np.array([row * width + (h1 + row * h2) % width for row in range(depth)], dtype=np.intp)
+
+
+@lru_cache(maxsize=4096)
+def _update_cells(keys, width, depth):
+    # Deduplicated so two keys of one update landing in the same cell are both counted
+    cells, counts = np.unique(np.concatenate([_cells(key, width, depth) for key in keys]), return_counts=True)
+    return cells, counts.astype(np.uint32)
+
+
+class CountMinSketch:
+    def __init__(self, width=2048, depth=4, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros(depth * width, dtype=np.uint32) if table is None else table
+
+    def add_many(self, keys):
+        cells, counts = _update_cells(tuple(keys), self.width, self.depth)
+        self.table[cells] += counts
+
+    def estimate(self, key):
+        return int(self.table[_cells(key, self.width, self.depth)].min())
+
+    def merge(self, other):
+        self.table += other.table
+
+
+class TDigest:
+    """Merging t-digest (Dunning) with the k1 scale function"""
+
+    def __init__(self, compression=100, buffer_size=256):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buffer = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self._buffer.append(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        if other.count == 0:
+            return
+        self._compress(other.means, other.weights)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _k_inverse(self, k):
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self, extra_means=None, extra_weights=None):
+        if not self._buffer and extra_means is None:
+            return
+        means = np.concatenate([self.means, np.asarray(self._buffer, dtype=float)] + ([extra_means] if extra_means is not None else []))
+        weights = np.concatenate([self.weights, np.ones(len(self._buffer))] + ([extra_weights] if extra_weights is not None else []))
+        self._buffer = []
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order].tolist(), weights[order].tolist()
+        total = sum(weights)
+
+        new_means, new_weights = [], []
+        current_mean, current_weight = means[0], weights[0]
+        cumulative = 0.0
+        limit = self._k_inverse(self._k(0) + 1) * total
+        for mean, weight in zip(means[1:], weights[1:]):
+            if cumulative + current_weight + weight <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                new_means.append(current_mean)
+                new_weights.append(current_weight)
+                cumulative += current_weight
+                limit = self._k_inverse(min(self._k(min(cumulative / total, 1.0)) + 1, self.compression / 4)) * total
+                current_mean, current_weight = mean, weight
+        new_means.append(current_mean)
+        new_weights.append(current_weight)
+        self.means = np.array(new_means)
+        self.weights = np.array(new_weights)
+
+    def quantile(self, q):
+        self._compress()
+        if self.count == 0:
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        # Interpolate between centroid centres, pinned to the observed min and max
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(
+            q * self.count,
+            np.concatenate([[0], centres, [self.count]]),
+            np.concatenate([[self.min], self.means, [self.max]])
+        ))
+
+    def state(self):
+        self._compress()
+        return [self.means.tobytes(), self.weights.tobytes(), self.count, self.min, self.max]
+
+    @classmethod
+    def from_state(cls, state, compression=100):
+        digest = cls(compression)
+        means, weights, digest.count, digest.min, digest.max = state
+        digest.means = np.frombuffer(means, dtype=float).copy()
+        digest.weights = np.frombuffer(weights, dtype=float).copy()
+        return digest
+
+
+class HyperLogLog:
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = np.zeros(self.size, dtype=np.uint8) if registers is None else registers
+
+    def add(self, key):
+        h = _hash128(key)[0]
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / np.sum(np.power(2.0, -self.registers.astype(float)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+
+class Bucket:
+    """Sketches for one time slice"""
+
+    def __init__(self, metrics, cms_width, cms_depth, hll_precision):
+        self.epoch = -1
+        self.count = 0
+        self.cms = CountMinSketch(cms_width, cms_depth)
+        self.hll = HyperLogLog(hll_precision)
+        self.digests = {name: TDigest() for name in metrics}
+
+    def reset(self, epoch):
+        self.epoch = epoch
+        self.count = 0
+        self.cms.table.fill(0)
+        self.hll.registers.fill(0)
+        for name in self.digests:
+            self.digests[name] = TDigest()
+
+    def merge(self, other):
+        self.count += other.count
+        self.cms.merge(other.cms)
+        self.hll.merge(other.hll)
+        for name, digest in other.digests.items():
+            self.digests[name].merge(digest)
+
+
+def category_key(**categories):
+    """Count-min key for one value or a pair of values, e.g. category_key(ageBin=2, highRisk=1)"""
+    return "&".join(f"{name}={value}" for name, value in sorted(categories.items()))
+
+
+@lru_cache(maxsize=4096)
+def _combination_keys(items):
+    items = [f"{name}={value}" for name, value in items]
+    return tuple(items + ["&".join(pair) for pair in combinations(items, 2)])
+
+
+def combination_keys(categories):
+    """Count-min keys for every single value and every pair of values, e.g. 'ageBin=2&highRisk=1'"""
+    return _combination_keys(tuple(sorted((name, value) for name, value in categories.items() if value is not None)))
+
+
+class LiveStats:
+    def __init__(self, metrics, bucket_seconds=60, buckets=60, cms_width=2048, cms_depth=4,
+                 hll_precision=12, spool_dir=None):
+        """
+        Parameters:
+        metrics (tuple): Names of the numeric values tracked with t-digests
+        bucket_seconds (int): Width of one time bucket
+        buckets (int): Buckets kept; the longest queryable window is bucket_seconds * buckets,
+            which must be at least a minute since windows are queried in minutes
+        cms_width, cms_depth (int): Count-min size; counts are over-estimated by at most
+            e/width of the bucket's total with probability 1 - e^-depth
+        hll_precision (int): 2^precision HyperLogLog registers, ~1.04/sqrt(2^precision) error
+        spool_dir (str): Directory where worker processes publish snapshots for merging
+        """
+        if bucket_seconds < 1 or buckets < 1 or bucket_seconds * buckets < 60:
+            raise ValueError("Live stats must keep at least one minute of buckets")
+        self.metrics = tuple(metrics)
+        self.bucket_seconds = bucket_seconds
+        self.sketch_args = (self.metrics, cms_width, cms_depth, hll_precision)
+        self.ring = [Bucket(*self.sketch_args) for _ in range(buckets)]
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._publisher = None
+        self._stop = threading.Event()
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    def start(self):
+        """Start publishing snapshots; must be called in the process that records (after fork)"""
+        if not self.spool_dir or self._publisher is not None:
+            return
+        self._stop.clear()
+        self._publisher = threading.Thread(target=self._run_publisher, name="live-stats-publisher", daemon=True)
+        self._publisher.start()
+
+    def stop(self, timeout=None):
+        """Stop the publisher and write a final snapshot (e.g. before a worker exits)"""
+        self._stop.set()
+        if self._publisher is not None:
+            self._publisher.join(timeout)
+            self._publisher = None
+        self.flush()
+
+    def _run_publisher(self):
+        # Idle workers don't rewrite an unchanged snapshot
+        while not self._stop.wait(SPOOL_INTERVAL_SECONDS):
+            if self._dirty:
+                self.flush()
+
+    def _bucket(self, now):
+        epoch = int(now // self.bucket_seconds)
+        bucket = self.ring[epoch % len(self.ring)]
+        if bucket.epoch != epoch:
+            bucket.reset(epoch)
+        return bucket
+
+    def record(self, categories, values=None, distinct=None, now=None):
+        """
+        Fold one observation into the current bucket
+
+        Parameters:
+        categories (dict): Categorical field -> value (None values are skipped)
+        values (dict): Metric name -> number (None values are skipped)
+        distinct (str): Identity counted by the distinct-count sketch
+        """
+        now = time.time() if now is None else now
+        keys = combination_keys(categories)
+        with self._lock:
+            bucket = self._bucket(now)
+            bucket.count += 1
+            bucket.cms.add_many(keys)
+            if distinct is not None:
+                bucket.hll.add(distinct)
+            for name, value in (values or {}).items():
+                if value is not None:
+                    bucket.digests[name].add(float(value))
+            self._dirty = True
+
+    def flush(self):
+        """Publish this process's snapshot now (e.g. before a worker exits)"""
+        if self.spool_dir:
+            with self._lock:
+                self._dirty = False
+                self._write_spool(time.time())
+
+    def _window_epochs(self, window_seconds, now):
+        current = int(now // self.bucket_seconds)
+        count = max(1, min(len(self.ring), math.ceil(window_seconds / self.bucket_seconds)))
+        return range(current - count + 1, current + 1)
+
+    def _encode(self, now):
+        epochs = self._window_epochs(self.bucket_seconds * len(self.ring), now)
+        return msgspec.msgpack.encode({
+            "bucketSeconds": self.bucket_seconds,
+            "buckets": [
+                {
+                    "epoch": bucket.epoch,
+                    "count": bucket.count,
+                    "cms": bucket.cms.table.tobytes(),
+                    "hll": bucket.hll.registers.tobytes(),
+                    "digests": {name: digest.state() for name, digest in bucket.digests.items()}
+                }
+                for bucket in self.ring if bucket.epoch in epochs and bucket.count
+            ]
+        })
+
+    def _write_spool(self, now):
+        path = os.path.join(self.spool_dir, f"{os.getpid()}.msgpack")
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(self._encode(now))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error writing live stats snapshot: {e}")
+
+    def _decode_buckets(self, data):
+        snapshot = msgspec.msgpack.decode(data)
+        if snapshot["bucketSeconds"] != self.bucket_seconds:
+            return
+        _, cms_width, cms_depth, hll_precision = self.sketch_args
+        for entry in snapshot["buckets"]:
+            bucket = Bucket.__new__(Bucket)
+            bucket.epoch = entry["epoch"]
+            bucket.count = entry["count"]
+            bucket.cms = CountMinSketch(cms_width, cms_depth, np.frombuffer(entry["cms"], dtype=np.uint32))
+            bucket.hll = HyperLogLog(hll_precision, np.frombuffer(entry["hll"], dtype=np.uint8))
+            bucket.digests = {name: TDigest.from_state(state) for name, state in entry["digests"].items()}
+            yield bucket
+
+    def _other_workers(self, max_age):
+        """Bucket lists from other processes' snapshots younger than max_age seconds"""
+        if not self.spool_dir:
+            return []
+        own = f"{os.getpid()}.msgpack"
+        snapshots = []
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".msgpack") or entry.name == own:
+                    continue
+                try:
+                    if time.time() - entry.stat().st_mtime > max_age:
+                        # Nothing in it is inside any window any more (e.g. a worker that exited)
+                        os.remove(entry.path)
+                        continue
+                    with open(entry.path, "rb") as f:
+                        snapshots.append(list(self._decode_buckets(f.read())))
+                except (OSError, msgspec.DecodeError, KeyError):
+                    continue
+        return snapshots
+
+    def snapshot(self, window_seconds, now=None):
+        """
+        Merge every bucket in the last window_seconds, across workers
+
+        Returns:
+        tuple: (merged Bucket, number of worker snapshots merged besides this process)
+        """
+        now = time.time() if now is None else now
+        epochs = self._window_epochs(window_seconds, now)
+        merged = Bucket(*self.sketch_args)
+        with self._lock:
+            for bucket in self.ring:
+                if bucket.epoch in epochs:
+                    merged.merge(bucket)
+
+        others = self._other_workers(self.bucket_seconds * len(self.ring))
+        for buckets in others:
+            for bucket in buckets:
+                if bucket.epoch in epochs:
+                    merged.merge(bucket)
+        return merged, len(others)
+
+    def memory_bytes(self):
+        """Size of the ring's count-min and HyperLogLog arrays; each t-digest adds at most a few KB"""
+        bucket = self.ring[0]
+        return len(self.ring) * (bucket.cms.table.nbytes + bucket.hll.registers.nbytes)
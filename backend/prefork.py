@@ -0,0 +1,313 @@
+# Production entry point: a pre-forking master for the Flask app
+# The master imports server.py once (datastore, knowledge base, analyzers, any models),
+# freezes the garbage collector so those objects are never touched by collections in the
+# workers, and then forks N workers that share the listening socket. Read-only state stays
+# in copy-on-write pages shared by every worker instead of being rebuilt per worker.
+# Each worker serves the app with waitress, a production WSGI server with a fixed pool of
+# request threads.
+#
+# Run with: python prefork.py --port 5000 [--workers N] [--threads N] [--no-preload]
+# Signals to the master:
+#   SIGHUP   graceful reload: re-exec the master (reloading code and data), start new
+#            workers, then let the old ones finish their in-flight requests and exit
+#   SIGUSR1  print a per-worker memory report (USS/PSS/RSS)
+#   SIGTERM / SIGINT  graceful shutdown
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from waitress import create_server
+from waitress import wasyncore
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Passed across a reload re-exec: the inherited listening socket and the workers to retire
+LISTEN_FD_ENV = "PREFORK_LISTEN_FD"
+OLD_WORKERS_ENV = "PREFORK_OLD_WORKERS"
+
+
+def default_worker_count():
+    """One worker per CPU this process may run on; request handling is CPU bound"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def memory_usage(pid):
+    """
+    Memory of one process in bytes from /proc/<pid>/smaps_rollup (Linux only)
+
+    Returns:
+    dict: rss, pss (shared pages split between sharers) and uss (pages private to the process)
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    }
+
+
+def print_memory_report(master_pid, worker_pids):
+    mb = 1024 * 1024
+    rows = [("master", master_pid)] + [(f"worker {i}", pid) for i, pid in enumerate(worker_pids)]
+    total_uss = 0
+    print("Memory report (MB):       USS      PSS      RSS")
+    for name, pid in rows:
+        usage = memory_usage(pid)
+        if usage is None:
+            print(f"  {name:<10} pid {pid:<7} unavailable")
+            continue
+        if name != "master":
+            total_uss += usage["uss"]
+        print(f"  {name:<10} pid {pid:<7} {usage['uss'] / mb:8.1f} {usage['pss'] / mb:8.1f} {usage['rss'] / mb:8.1f}")
+    if worker_pids:
+        print(f"  workers: total USS {total_uss / mb:.1f} MB, {total_uss / mb / len(worker_pids):.1f} MB per worker")
+    sys.stdout.flush()
+
+
+def listening_socket(host, port, backlog):
+    inherited = os.environ.pop(LISTEN_FD_ENV, None)
+    if inherited is not None:
+        sock = socket.socket(fileno=int(inherited))
+    else:
+        sock = socket.create_server((host, port), backlog=backlog, reuse_port=False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def load_app():
+    """Import the app with its shared state; relative data paths resolve from the backend directory"""
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+
+def run_worker(sock, preload, threads, backlog):
+    """Serve requests in a forked worker until SIGTERM, then finish in-flight requests and exit"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Reload and report requests are for the master; a signal sent to the whole process
+    # group must not kill the workers
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    # Forked workers inherit the master's random state; reseed so they don't all agree
+    random.seed()
+    server = load_app() if not preload else sys.modules["server"]
+    server.np.random.seed()
+    gc.enable()
+
+    httpd = create_server(server.app, sockets=[sock], threads=threads, backlog=backlog,
+                          asyncore_use_poll=True)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    # Background threads don't survive fork, so they are started per worker
+    server.job_queue.start()
+    server.live_stats.start()
+    while not stopping.is_set():
+        wasyncore.loop(timeout=1, map=httpd._map, use_poll=True, count=1)
+
+    # Stop accepting (other workers take over the shared socket) and close connections as
+    # they go idle; requests in flight, and their responses, are still served. The master
+    # kills workers that are still draining after its graceful timeout.
+    httpd.accepting = False
+    while httpd.active_channels:
+        for channel in list(httpd.active_channels.values()):
+            if not channel.requests:
+                channel.close_when_flushed = True
+        wasyncore.loop(timeout=0.1, map=httpd._map, use_poll=True, count=1)
+    httpd.task_dispatcher.shutdown()
+    server.job_queue.stop(timeout=5)
+    server.live_stats.stop(timeout=5)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+class Master:
+    def __init__(self, args):
+        self.args = args
+        self.workers = set()
+        self.retiring = set()
+        self.stopping = False
+        self.reloading = False
+        self.report_requested = False
+        # Crashed workers are replaced at most once per second, so a broken deploy can't spin
+        self.pending_spawns = 0
+        self.next_spawn = 0
+        self.limits = None
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.sock, self.args.preload, self.args.threads, self.args.backlog)
+            except BaseException:
+                traceback.print_exc()
+                sys.stderr.flush()
+            finally:
+                os._exit(1)
+        self.workers.add(pid)
+        return pid
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.limits is not None:
+                # A worker killed mid-request never released its admission slots
+                self.limits.reclaim(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping and not self.reloading:
+                    print(f"Worker {pid} exited with status {status}, restarting it")
+                    self.pending_spawns += 1
+
+    def signal_workers(self, pids, signum):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reload(self):
+        """Re-exec the master; the new master retires the current workers once its own are up"""
+        print("Reloading: re-executing the master process")
+        sys.stdout.flush()
+        self.sock.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(str(pid) for pid in self.workers | self.retiring)
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+
+    def run(self):
+        args = self.args
+        self.sock = listening_socket(args.host, args.port, args.backlog)
+
+        if args.preload:
+            # Collections during import would only fragment the heap we are about to share
+            gc.disable()
+            started = time.perf_counter()
+            load_app()
+            gc.collect()
+            # Move everything allocated so far to a permanent generation that collections in
+            # the workers never scan, so they don't write to (and copy) the shared pages
+            gc.freeze()
+            print(f"Preloaded application state in {time.perf_counter() - started:.2f}s")
+
+        old_workers = os.environ.pop(OLD_WORKERS_ENV, "")
+        self.retiring = {int(pid) for pid in old_workers.split(",") if pid}
+
+        if os.environ.get("RATE_LIMIT_SHARED_FILE"):
+            from rate_limit import SharedMemoryBackend
+            self.limits = SharedMemoryBackend(os.environ["RATE_LIMIT_SHARED_FILE"])
+            # Slots left behind by the workers of a previous run that crashed or was killed
+            self.limits.reclaim_dead()
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stopping", True))
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "reloading", True))
+        signal.signal(signal.SIGUSR1, lambda signum, frame: setattr(self, "report_requested", True))
+
+        for _ in range(args.workers):
+            self.spawn()
+        print(f"Master {os.getpid()} serving on {args.host}:{args.port} with {args.workers} workers "
+              f"({'preloaded' if args.preload else 'per-worker import'})")
+
+        # New workers are up, so workers of the previous generation can drain and exit
+        self.signal_workers(self.retiring, signal.SIGTERM)
+
+        next_report = time.time() + args.memory_report_interval if args.memory_report_interval else None
+        while True:
+            self.reap()
+            if self.stopping:
+                break
+            if self.reloading:
+                self.reload()
+            if self.pending_spawns and time.time() >= self.next_spawn:
+                self.pending_spawns -= 1
+                self.next_spawn = time.time() + 1
+                self.spawn()
+            if self.report_requested or (next_report and time.time() >= next_report):
+                self.report_requested = False
+                if next_report:
+                    next_report = time.time() + args.memory_report_interval
+                print_memory_report(os.getpid(), sorted(self.workers))
+            time.sleep(0.2)
+
+        print("Shutting down workers")
+        self.signal_workers(self.workers | self.retiring, signal.SIGTERM)
+        deadline = time.time() + args.graceful_timeout
+        while (self.workers or self.retiring) and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(self.workers | self.retiring, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forking production server for the ArogyaAI+ backend")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="Number of worker processes (default: one per CPU)")
+    parser.add_argument("--threads", type=int, default=8, help="Request threads per worker")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=float, default=30, help="Seconds to wait for workers to finish on shutdown")
+    parser.add_argument("--memory-report-interval", type=float, default=0, help="Print a memory report every N seconds")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Import the app separately in every worker (for comparing memory use)")
+    args = parser.parse_args()
+    if args.workers <= 0:
+        args.workers = default_worker_count()
+
+    # Rate limits must be shared between workers to mean anything
+    os.environ.setdefault(
+        "RATE_LIMIT_SHARED_FILE",
+        os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), f"arogya-limits-{args.port}")
+    )
+
+    # Live statistics are merged from per-worker snapshots in a shared directory
+    os.environ.setdefault(
+        "LIVE_STATS_DIR",
+        os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), f"arogya-live-stats-{args.port}")
+    )
+
+    # Chat sessions are written through to a shared directory, so any worker can continue them
+    if "CHAT_SPILL_DIR" not in os.environ:
+        os.environ["CHAT_SPILL_DIR"] = os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), f"arogya-chat-sessions-{args.port}"
+        )
+        os.environ.setdefault("CHAT_SHARED_SESSIONS", "1")
+
+    # Split the CPUs between workers so inference thread pools don't oversubscribe the host
+    os.environ.setdefault("INFERENCE_INTRA_OP_THREADS", str(max(1, default_worker_count() // args.workers)))
+
+    Master(args).run()
+
+
+if __name__ == "__main__":
+    main()
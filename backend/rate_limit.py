@@ -0,0 +1,391 @@
+# Admission control for expensive endpoints
+# Every limited endpoint belongs to a class with a per-client token bucket (rate/burst)
+# and a cap on requests in flight. Checks run in before_request, i.e. before Flask reads
+# the request body, so a rejected 16 MB upload costs one lookup rather than a full read.
+# State lives in process by default; SharedMemoryBackend keeps it in a file-backed mmap
+# guarded by flock, so the limits hold across all worker processes on a host.
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import g, jsonify, request
+
+# Header clients use to identify themselves; only keys in the configured allowlist are
+# honoured, and clients without a key are identified by their remote address
+API_KEY_HEADER = "X-API-Key"
+
+# Buckets that have refilled completely are dropped this often, since a full bucket and a
+# missing one admit the same way
+SWEEP_INTERVAL_SECONDS = 60
+
+# A class at its in-flight limit looks for slots held by dead processes at most this often
+RECLAIM_INTERVAL_SECONDS = 1
+
+
+def load_api_keys(value):
+    """Parse a comma separated list of API keys (e.g. the API_KEYS setting) into a set"""
+    return frozenset(key.strip() for key in (value or "").split(",") if key.strip())
+
+
+def client_identity(api_key, remote_addr, api_keys):
+    """
+    Identify a client for rate limiting
+
+    Returns:
+    str: "key:<key>" for a key in api_keys, "ip:<address>" when no key is sent, or None
+    for a key that is not allowed; a client choosing its own key would otherwise get a
+    fresh bucket with every request
+    """
+    if api_key:
+        return f"key:{api_key}" if api_key in api_keys else None
+    return f"ip:{remote_addr or 'unknown'}"
+
+
+def client_key(req, api_keys=frozenset()):
+    return client_identity(req.headers.get(API_KEY_HEADER), req.remote_addr, api_keys)
+
+
+def _refill(tokens, last, now, rate, burst):
+    """Token bucket update; returns (tokens left, seconds until the next token or 0 if admitted)"""
+    tokens = min(burst, tokens + (now - last) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class LocalBackend:
+    """Limiter state for a single process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, last refill time, time the bucket is full again)
+        self._in_flight = {}
+        self._last_sweep = None
+
+    def admit(self, key, name, rate, burst, limit, now):
+        """Take a token from bucket `key`, then an in-flight slot of class `name`"""
+        with self._lock:
+            self._maybe_sweep(now)
+            tokens, last, _ = self._buckets.get(key, (burst, now, now))
+            tokens, retry_after = _refill(tokens, last, now, rate, burst)
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if retry_after:
+                return 429, retry_after
+
+            count = self._in_flight.get(name, 0)
+            if count >= limit:
+                return 503, 1
+            self._in_flight[name] = count + 1
+            return None
+
+    def release(self, name):
+        with self._lock:
+            self._in_flight[name] -= 1
+
+    def _maybe_sweep(self, now):
+        if self._last_sweep is None:
+            self._last_sweep = now
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+
+class SharedMemoryBackend:
+    """
+    Limiter state shared by every process that opens the same file
+
+    Buckets live in a fixed-size open-addressing table, so memory does not grow with the
+    number of clients; when a probe window is full the longest idle bucket is reused,
+    which only ever resets an idle client to a full bucket.
+
+    Each class has a total in-flight counter plus one counter per process holding slots,
+    so the slots of a process that dies mid-request can be given back: reclaim(pid) when
+    its parent reaps it, or reclaim_dead() for every process that no longer exists. A
+    class at its limit also calls reclaim_dead() itself, so a stale file left by a
+    crash or a restart never keeps a class full.
+    """
+
+    _BUCKET = struct.Struct("<Qdd")   # key hash, tokens, last refill time
+    _COUNTER = struct.Struct("<QQq")  # name hash, owning pid (0 for the class total), requests in flight
+    PROBE_LENGTH = 8
+    COUNTER_SLOTS = 1024
+
+    def __init__(self, path, slots=4096):
+        import fcntl
+        self._fcntl = fcntl
+        self.slots = slots
+        self._counters_offset = slots * self._BUCKET.size
+        size = self._counters_offset + self.COUNTER_SLOTS * self._COUNTER.size
+
+        self.path = path
+        self._pid = os.getpid()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                # Another process may have sized it while we waited for the lock; otherwise
+                # the file is new or has an older layout, so start from an empty table
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        # flock serialises processes; threads in one process share the fd and need a lock too
+        self._thread_lock = threading.Lock()
+        self._name_hashes = {}
+        self._counter_offsets = {}
+        self._next_reclaim = 0
+
+    @staticmethod
+    def _hash(key):
+        # Stable across processes (unlike hash()); 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    def _name_hash(self, name):
+        # Class names are few and fixed, so their hashes are computed once
+        name_hash = self._name_hashes.get(name)
+        if name_hash is None:
+            name_hash = self._name_hashes[name] = self._hash(name)
+        return name_hash
+
+    def _locked(self, func, *args):
+        if self._pid != os.getpid():
+            # flock locks belong to the open file description, which a forked child shares
+            # with its parent; reopen so each process really excludes the others
+            self._pid = os.getpid()
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._thread_lock = threading.Lock()
+            self._counter_offsets = {}
+        with self._thread_lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                return func(*args)
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def admit(self, key, name, rate, burst, limit, now):
+        # Both checks run under a single lock round trip
+        return self._locked(self._admit, self._hash(key), self._name_hash(name), rate, burst, limit, now)
+
+    def _admit(self, key_hash, name_hash, rate, burst, limit, now):
+        retry_after = self._take(key_hash, rate, burst, now)
+        if retry_after:
+            return 429, retry_after
+        if not self._acquire(name_hash, limit):
+            return 503, 1
+        return None
+
+    def _take(self, key_hash, rate, burst, now):
+        bucket = self._BUCKET
+        start = key_hash % self.slots
+        offset = None
+        oldest = None
+        for probe in range(self.PROBE_LENGTH):
+            slot_offset = ((start + probe) % self.slots) * bucket.size
+            slot_hash, tokens, last = bucket.unpack_from(self._map, slot_offset)
+            if slot_hash == key_hash:
+                offset = slot_offset
+                break
+            if slot_hash == 0:
+                offset, tokens, last = slot_offset, burst, now
+                break
+            if oldest is None or last < oldest[1]:
+                oldest = (slot_offset, last)
+        if offset is None:
+            offset, tokens, last = oldest[0], burst, now
+
+        tokens, retry_after = _refill(tokens, last, now, rate, burst)
+        bucket.pack_into(self._map, offset, key_hash, tokens, now)
+        return retry_after
+
+    def _counters(self):
+        """(offset, name hash, pid, count) of every occupied counter slot"""
+        counter = self._COUNTER
+        end = self._counters_offset + self.COUNTER_SLOTS * counter.size
+        for slot, (name_hash, pid, count) in enumerate(counter.iter_unpack(self._map[self._counters_offset:end])):
+            if name_hash:
+                yield self._counters_offset + slot * counter.size, name_hash, pid, count
+
+    def _counter_offset(self, name_hash, pid):
+        counter = self._COUNTER
+        offset = self._counter_offsets.get((name_hash, pid))
+        # Slots of other processes can be freed and reused, so check the cached one still matches
+        if offset is not None and counter.unpack_from(self._map, offset)[:2] == (name_hash, pid):
+            return offset
+        self._counter_offsets.pop((name_hash, pid), None)
+
+        for attempt in range(2):
+            occupied = set()
+            for offset, slot_hash, slot_pid, _ in self._counters():
+                if slot_hash == name_hash and slot_pid == pid:
+                    self._counter_offsets[(name_hash, pid)] = offset
+                    return offset
+                occupied.add(offset)
+            for slot in range(self.COUNTER_SLOTS):
+                offset = self._counters_offset + slot * counter.size
+                if offset not in occupied:
+                    counter.pack_into(self._map, offset, name_hash, pid, 0)
+                    self._counter_offsets[(name_hash, pid)] = offset
+                    return offset
+            # The table is full; rows of processes that exited without being reclaimed can go
+            self._reclaim(lambda slot_pid: not _pid_alive(slot_pid))
+        raise RuntimeError("Too many admission classes or processes for the shared limiter")
+
+    def _acquire(self, name_hash, limit):
+        counter = self._COUNTER
+        total = self._counter_offset(name_hash, 0)
+        _, _, count = counter.unpack_from(self._map, total)
+        if count >= limit:
+            now = time.monotonic()
+            if now < self._next_reclaim:
+                return False
+            self._next_reclaim = now + RECLAIM_INTERVAL_SECONDS
+            self._reclaim(lambda pid: not _pid_alive(pid))
+            _, _, count = counter.unpack_from(self._map, total)
+            if count >= limit:
+                return False
+        pid = os.getpid()
+        own = self._counter_offset(name_hash, pid)
+        counter.pack_into(self._map, total, name_hash, 0, count + 1)
+        counter.pack_into(self._map, own, name_hash, pid, counter.unpack_from(self._map, own)[2] + 1)
+        return True
+
+    def release(self, name):
+        self._locked(self._release, self._name_hash(name))
+
+    def _release(self, name_hash):
+        counter = self._COUNTER
+        pid = os.getpid()
+        own = self._counter_offset(name_hash, pid)
+        _, _, held = counter.unpack_from(self._map, own)
+        # Slots already reclaimed from this process were taken off the total at the time
+        if held <= 0:
+            return
+        counter.pack_into(self._map, own, name_hash, pid, held - 1)
+        total = self._counter_offset(name_hash, 0)
+        _, _, count = counter.unpack_from(self._map, total)
+        counter.pack_into(self._map, total, name_hash, 0, max(0, count - 1))
+
+    def reclaim(self, pid):
+        """
+        Give back the in-flight slots held by a process that has exited
+
+        Returns:
+        int: Number of slots reclaimed
+        """
+        return self._locked(self._reclaim, lambda slot_pid: slot_pid == pid)
+
+    def reclaim_dead(self):
+        """
+        Give back the in-flight slots of every process that no longer exists
+
+        Returns:
+        int: Number of slots reclaimed
+        """
+        return self._locked(self._reclaim, lambda pid: not _pid_alive(pid))
+
+    def _reclaim(self, matches):
+        counter = self._COUNTER
+        freed = {}
+        slots = list(self._counters())
+        for offset, name_hash, pid, count in slots:
+            if pid and matches(pid):
+                freed[name_hash] = freed.get(name_hash, 0) + max(0, count)
+                counter.pack_into(self._map, offset, 0, 0, 0)
+        for offset, name_hash, pid, count in slots:
+            if not pid and freed.get(name_hash):
+                counter.pack_into(self._map, offset, name_hash, 0, max(0, count - freed[name_hash]))
+        reclaimed = sum(freed.values())
+        if reclaimed:
+            print(f"Reclaimed {reclaimed} admission slot(s) held by exited processes")
+        return reclaimed
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AdmissionController:
+    def __init__(self, backend, classes, endpoints, api_keys=frozenset(), key_func=None):
+        """
+        Parameters:
+        backend: LocalBackend or SharedMemoryBackend
+        classes (dict): Class name -> {"rate": tokens/second, "burst": bucket size, "concurrency": max in flight}
+        endpoints (dict): Flask endpoint (view function) name -> class name
+        api_keys (set): API keys clients may identify themselves with
+        key_func (callable): request -> client identifier, or None to reject the request;
+            defaults to client_key with api_keys
+        """
+        self.backend = backend
+        self.classes = classes
+        self.endpoints = endpoints
+        self.api_keys = frozenset(api_keys)
+        self.key_func = key_func or (lambda req: client_key(req, self.api_keys))
+
+    def check(self, class_name, client, now=None):
+        """
+        Admit or reject one request
+
+        Returns:
+        tuple: (status code, seconds to wait) if rejected, None if admitted; an admitted
+        request holds an in-flight slot until release() is called
+        """
+        limits = self.classes[class_name]
+        now = time.monotonic() if now is None else now
+
+        return self.backend.admit(
+            f"{class_name}:{client}", class_name,
+            limits["rate"], limits["burst"], limits["concurrency"], now
+        )
+
+    def release(self, class_name):
+        self.backend.release(class_name)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        class_name = self.endpoints.get(request.endpoint)
+        # CORS preflights carry no body and must not use up the client's budget
+        if class_name is None or request.method == "OPTIONS":
+            return None
+
+        client = self.key_func(request)
+        if client is None:
+            response = jsonify({"error": "Unknown API key"})
+            response.status_code = 401
+            response.headers["Connection"] = "close"
+            return response
+
+        rejected = self.check(class_name, client)
+        if rejected is None:
+            g.admission_class = class_name
+            return None
+
+        status, retry_after = rejected
+        message = "Rate limit exceeded" if status == 429 else "Server busy, try again shortly"
+        response = jsonify({"error": message})
+        response.status_code = status
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        # Don't keep the connection around just to drain an unread upload
+        response.headers["Connection"] = "close"
+        return response
+
+    def _teardown_request(self, exc):
+        class_name = g.pop("admission_class", None)
+        if class_name is not None:
+            self.release(class_name)
@@ -0,0 +1,84 @@
+# Typed request schemas
+# JSON bodies are decoded straight from the raw request bytes into these structs with
+# msgspec, which checks types and ranges while parsing instead of building a dict tree
+# and validating it afterwards. Each body is decoded once at the edge; handlers and
+# analyzers then read typed attributes, and bad input fails with a 400 naming the field.
+
+from typing import Annotated, Optional, Union
+
+import msgspec
+from msgspec import Meta, Struct, field
+
+Age = Annotated[int, Meta(ge=0, le=130)]
+# Codes as encoded in datastore1.csv
+Gender = Annotated[int, Meta(ge=0, le=1)]
+BloodType = Annotated[int, Meta(ge=0, le=7)]
+TestResult = Annotated[int, Meta(ge=0, le=1)]
+SessionId = Annotated[str, Meta(min_length=1, max_length=128)]
+
+
+class UserInfo(Struct):
+    age: Age = 30
+    region: Optional[str] = None
+    has_chronic_conditions: bool = False
+
+
+class SymptomRequest(Struct, rename="camel"):
+    symptoms: str = ""
+    user_info: UserInfo = field(default_factory=UserInfo)
+
+
+class ReportRequest(Struct, rename="camel"):
+    age: Age = 30
+    gender: Gender = 0  # Default to female
+    blood_type: Optional[BloodType] = None
+    test_result: Optional[TestResult] = None
+    billing_amount: Optional[Annotated[float, Meta(ge=0)]] = None
+
+
+class ChatRequest(Struct, rename="camel"):
+    message: str = ""
+    session_id: Optional[SessionId] = None
+
+
+# Client frames on the chat WebSocket, told apart by their "type" field. One connection
+# can carry several sessions; "id" is echoed back so replies can be matched to messages
+class ChatFrame(Struct, tag="chat", rename="camel"):
+    message: str = ""
+    session_id: Optional[SessionId] = None
+    id: Optional[Union[int, str]] = None
+
+
+class EndSessionFrame(Struct, tag="end", rename="camel"):
+    session_id: SessionId
+    id: Optional[Union[int, str]] = None
+
+
+ClientFrame = Union[ChatFrame, EndSessionFrame]
+
+
+# Decoders are built once per schema; building one compiles the type's validation plan
+_decoders = {}
+
+
+def decode(data, schema):
+    """
+    Decode and validate a JSON body
+
+    Parameters:
+    data (bytes): Raw request body
+    schema (type): Struct type to decode into
+
+    Returns:
+    Struct: An instance of schema; raises msgspec.DecodeError (or its subclass
+    msgspec.ValidationError) on malformed or invalid input
+    """
+    decoder = _decoders.get(schema)
+    if decoder is None:
+        decoder = _decoders[schema] = msgspec.json.Decoder(schema)
+    return decoder.decode(data)
+
+
+def convert(record, schema):
+    """Validate an already parsed record (e.g. a CSV row) against a schema"""
+    return msgspec.convert(record, schema)
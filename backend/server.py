@@ -1,20 +1,36 @@
 # This file represents a simplified backend server (Python/Flask) implementation
 # For a real production application, it would need proper error handling, security, etc.
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_file
 from flask_cors import CORS
+import msgspec
 import numpy as np
 import json
 import os
+import random
 from datetime import datetime
 import threading
 import time
-import pandas as pd
 from werkzeug.utils import secure_filename
 import uuid
 import base64
 import io
+import csv
+import zipfile
+import zlib
 from PIL import Image
+from cohort_stats import CohortIndex, CATEGORICAL_COLUMNS, parse_filter_values
+from image_cache import PrescriptionCache
+from inference import InferenceModel
+from ingest import ingest
+from job_queue import JobQueue
+from knowledge_store import open_store
+from live_stats import LiveStats, category_key
+from rate_limit import AdmissionController, LocalBackend, SharedMemoryBackend, client_identity, client_key, load_api_keys
+from schemas import ChatRequest, ReportRequest, SymptomRequest, convert, decode
+from session_store import SessionStore
+from streaming import NDJSON_MIMETYPE, NEXT_CURSOR_HEADER, list_response, paginate
+from tracing import TRACE_ID_HEADER, FileExporter, Tracer, span
 
 # Import ML libraries
 # In a production environment, you would use proper ML frameworks like PyTorch, TensorFlow, etc.
@@ -28,17 +44,49 @@ except ImportError:
     print("ML libraries not found. Running in mock mode.")
 
 app = Flask(__name__)
-CORS(app)  # Allow cross-origin requests
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER, "X-Prescription-Cache", TRACE_ID_HEADER])  # Allow cross-origin requests
 
-# Load the datastore1.csv file
+# Load the datastore. DATASTORE_PATH may be a CSV file, a directory of CSV shards or a
+# glob pattern; shards are parsed and aggregated in parallel across INGEST_WORKERS processes
+DATASTORE_PATH = os.environ.get("DATASTORE_PATH", "../datastore1.csv")
 try:
-    datastore_df = pd.read_csv('../datastore1.csv')
-    HAS_DATASTORE = True
-    print(f"Loaded datastore1.csv with {len(datastore_df)} records")
+    datastore = ingest(DATASTORE_PATH, workers=int(os.environ.get("INGEST_WORKERS", 0)) or None)
+    HAS_DATASTORE = datastore.rows > 0
+    datastore_summary = datastore.summary()
+    print(f"Loaded {datastore_summary['rows']} records from {datastore_summary['shards']} datastore shard(s) in "
+          f"{datastore_summary['seconds']:.2f}s with {datastore_summary['workers']} worker(s)")
+    for shard in datastore.shards:
+        if shard["error"]:
+            print(f"  Skipped {shard['path']}: {shard['error']}")
+        elif shard["malformedRows"]:
+            print(f"  Skipped {shard['malformedRows']} malformed rows in {shard['path']}")
 except Exception as e:
     HAS_DATASTORE = False
-    print(f"Failed to load datastore1.csv: {e}")
-    datastore_df = None
+    print(f"Failed to load datastore from {DATASTORE_PATH}: {e}")
+    datastore = None
+
+# Optional transformer models: set SYMPTOM_MODEL / CHAT_MODEL to a model ID or local path.
+# INFERENCE_BACKEND picks eager (fp32), torch-int8 or onnx-int8; ONNX artifacts are exported,
+# quantized and cached in MODEL_CACHE_DIR once, then reused on every start
+def load_inference_model(task, env_var):
+    if not HAS_ML_LIBS or not os.environ.get(env_var):
+        return None
+    try:
+        model = InferenceModel(
+            task,
+            os.environ[env_var],
+            backend=os.environ.get("INFERENCE_BACKEND", "onnx-int8"),
+            cache_dir=os.environ.get("MODEL_CACHE_DIR", "model_cache")
+        )
+        model.prepare()
+        print(f"Prepared {task} model {model.model_id} ({model.backend})")
+        return model
+    except Exception as e:
+        print(f"Error loading {task} model: {e}")
+        return None
+
+symptom_model = load_inference_model("text-classification", "SYMPTOM_MODEL")
+chat_model = load_inference_model("text-generation", "CHAT_MODEL")
 
 # Mock database (in a real app, use MongoDB or similar)
 users_db = {}
@@ -46,54 +94,15 @@ health_records_db = {}
 appointments_db = {}
 medications_db = {}
 
-# Medical knowledge base - Adding scientific medical knowledge
-medical_knowledge_db = {
-    "hypertension": {
-        "id": "HTN-001",
-        "name": "Hypertension",
-        "description": "A chronic condition in which the blood pressure in the arteries is elevated.",
-        "risk_factors": ["Age over 50", "Family history", "High sodium diet", "Obesity", "Sedentary lifestyle"],
-        "complications": ["Heart disease", "Stroke", "Kidney damage", "Vision loss"],
-        "treatments": ["Lifestyle modifications", "Diuretics", "ACE inhibitors", "Beta blockers"],
-        "prevention": ["Regular exercise", "Healthy diet", "Sodium restriction", "Limiting alcohol", "Not smoking"]
-    },
-    "diabetes": {
-        "id": "DM-001",
-        "name": "Diabetes Mellitus",
-        "description": "A metabolic disorder characterized by high blood sugar over a prolonged period.",
-        "risk_factors": ["Family history", "Obesity", "Physical inactivity", "Age over 45", "Gestational diabetes"],
-        "complications": ["Heart disease", "Kidney disease", "Neuropathy", "Retinopathy"],
-        "treatments": ["Insulin therapy", "Oral medications", "Diet management", "Regular exercise"],
-        "prevention": ["Weight management", "Regular physical activity", "Balanced diet"]
-    },
-    "asthma": {
-        "id": "ASTH-001",
-        "name": "Asthma",
-        "description": "A chronic condition affecting the airways in the lungs, causing breathing difficulty.",
-        "risk_factors": ["Allergies", "Family history", "Respiratory infections", "Air pollution", "Smoking"],
-        "complications": ["Sleep disturbances", "Permanent airway remodeling", "Work/school absenteeism"],
-        "treatments": ["Bronchodilators", "Inhaled corticosteroids", "Leukotriene modifiers", "Immunotherapy"],
-        "prevention": ["Avoiding triggers", "Regular medication", "Allergy management"]
-    },
-    "arthritis": {
-        "id": "ARTH-001",
-        "name": "Arthritis",
-        "description": "Inflammation of one or more joints, causing pain and stiffness.",
-        "risk_factors": ["Age over 65", "Female gender", "Previous joint injury", "Obesity", "Family history"],
-        "complications": ["Joint deformity", "Reduced mobility", "Chronic pain"],
-        "treatments": ["Physical therapy", "Anti-inflammatory medications", "Joint replacement", "Weight management"],
-        "prevention": ["Joint-friendly exercise", "Maintaining healthy weight", "Avoiding joint injuries"]
-    },
-    "heart_disease": {
-        "id": "HD-001",
-        "name": "Heart Disease",
-        "description": "A range of conditions affecting heart function and structure.",
-        "risk_factors": ["Hypertension", "High cholesterol", "Smoking", "Diabetes", "Family history", "Age"],
-        "complications": ["Heart failure", "Arrhythmias", "Heart attack", "Sudden cardiac death"],
-        "treatments": ["Medications", "Lifestyle changes", "Surgical procedures", "Cardiac rehabilitation"],
-        "prevention": ["Regular exercise", "Heart-healthy diet", "Not smoking", "Stress management"]
-    }
-}
+# Medical knowledge base, compiled from data/medical_knowledge.json into a memory-mapped
+# store (see knowledge_store.py); records are decoded on first access
+# The sources ship with the code, so a store that can't be opened fails start-up
+KNOWLEDGE_DIR = os.environ.get("KNOWLEDGE_DIR", "data")
+
+def load_knowledge(file_name, search_fields=()):
+    return open_store(os.path.join(KNOWLEDGE_DIR, file_name), search_fields=search_fields)
+
+medical_knowledge_db = load_knowledge("medical_knowledge.json", search_fields=("name", "description"))
 
 # Enhanced symptom analyzer that uses the CSV data
 class EnhancedSymptomAnalyzer:
@@ -126,58 +135,37 @@ class EnhancedSymptomAnalyzer:
         
         # Load and process datastore
         self.datastore_processed = False
-        if HAS_DATASTORE and datastore_df is not None:
+        if HAS_DATASTORE:
             self.process_datastore()
     
     def process_datastore(self):
-        """Process the datastore1.csv to extract patterns for symptom analysis"""
+        """Build symptom analysis patterns from the datastore's disease contingency tables"""
         try:
             # Create disease patterns dictionary
             self.disease_patterns = {}
             
-            # Group by Disease and Age_Bin to identify age-related patterns
-            disease_age_groups = datastore_df.groupby(['Disease', 'Age_Bin']).size().reset_index(name='count')
-            
-            # Group by Disease and Blood Type to identify blood type patterns
-            disease_blood_groups = datastore_df.groupby(['Disease', 'Blood Type']).size().reset_index(name='count')
-            
-            # Process age bin patterns
-            for _, row in disease_age_groups.iterrows():
-                disease = int(row['Disease'])
-                age_bin = int(row['Age_Bin'])
+            # Age-related patterns
+            for disease, counts in datastore.crosstab('Age_Bin').items():
                 disease_name = self.disease_mapping.get(disease, f"Unknown Disease {disease}")
-                
-                if disease_name not in self.disease_patterns:
-                    self.disease_patterns[disease_name] = {'age_bins': {}, 'blood_types': {}}
-                
-                self.disease_patterns[disease_name]['age_bins'][age_bin] = row['count']
+                patterns = self.disease_patterns.setdefault(disease_name, {'age_bins': {}, 'blood_types': {}})
+                patterns['age_bins'].update(counts)
             
-            # Process blood type patterns
-            for _, row in disease_blood_groups.iterrows():
-                disease = int(row['Disease'])
-                blood_type = int(row['Blood Type'])
+            # Blood type patterns
+            for disease, counts in datastore.crosstab('Blood Type').items():
                 disease_name = self.disease_mapping.get(disease, f"Unknown Disease {disease}")
-                
-                if disease_name not in self.disease_patterns:
-                    self.disease_patterns[disease_name] = {'age_bins': {}, 'blood_types': {}}
-                
-                blood_type_name = self.blood_type_mapping.get(blood_type, f"Unknown Blood Type {blood_type}")
-                self.disease_patterns[disease_name]['blood_types'][blood_type_name] = row['count']
+                patterns = self.disease_patterns.setdefault(disease_name, {'age_bins': {}, 'blood_types': {}})
+                for blood_type, count in counts.items():
+                    blood_type_name = self.blood_type_mapping.get(blood_type, f"Unknown Blood Type {blood_type}")
+                    patterns['blood_types'][blood_type_name] = count
             
-            # Calculate disease prevalence by test results
-            disease_test_result = datastore_df.groupby(['Disease', 'Test Result']).size().reset_index(name='count')
-            for _, row in disease_test_result.iterrows():
-                disease = int(row['Disease'])
-                test_result = int(row['Test Result'])
+            # Disease prevalence by test results
+            for disease, counts in datastore.crosstab('Test Result').items():
                 disease_name = self.disease_mapping.get(disease, f"Unknown Disease {disease}")
-                
-                if 'test_results' not in self.disease_patterns[disease_name]:
-                    self.disease_patterns[disease_name]['test_results'] = {}
-                
-                self.disease_patterns[disease_name]['test_results'][test_result] = row['count']
+                patterns = self.disease_patterns.setdefault(disease_name, {'age_bins': {}, 'blood_types': {}})
+                patterns['test_results'] = counts
             
             self.datastore_processed = True
-            print("Successfully processed datastore1.csv for enhanced symptom analysis")
+            print("Successfully processed datastore for enhanced symptom analysis")
         except Exception as e:
             print(f"Error processing datastore: {e}")
     
@@ -326,96 +314,41 @@ class MedicalReportAnalyzer:
         
         # Load and process datastore
         self.datastore_processed = False
-        if HAS_DATASTORE and datastore_df is not None:
+        if HAS_DATASTORE:
             self.process_datastore()
     
     def process_datastore(self):
-        """Process the datastore1.csv for medical report analysis"""
+        """Load the datastore's disease contingency tables for medical report analysis"""
         try:
-            # Disease-Age correlations
-            disease_age_corr = datastore_df.groupby(['Disease', 'Age_Bin']).size().reset_index(name='count')
-            self.disease_age_corr = {}
-            for _, row in disease_age_corr.iterrows():
-                disease = int(row['Disease'])
-                age_bin = int(row['Age_Bin'])
-                count = row['count']
-                
-                if disease not in self.disease_age_corr:
-                    self.disease_age_corr[disease] = {}
-                
-                self.disease_age_corr[disease][age_bin] = count
-            
-            # Disease-Gender correlations
-            disease_gender_corr = datastore_df.groupby(['Disease', 'Gender']).size().reset_index(name='count')
-            self.disease_gender_corr = {}
-            for _, row in disease_gender_corr.iterrows():
-                disease = int(row['Disease'])
-                gender = int(row['Gender'])
-                count = row['count']
-                
-                if disease not in self.disease_gender_corr:
-                    self.disease_gender_corr[disease] = {}
-                
-                self.disease_gender_corr[disease][gender] = count
-            
-            # Disease-Blood Type correlations
-            disease_blood_corr = datastore_df.groupby(['Disease', 'Blood Type']).size().reset_index(name='count')
-            self.disease_blood_corr = {}
-            for _, row in disease_blood_corr.iterrows():
-                disease = int(row['Disease'])
-                blood_type = int(row['Blood Type'])
-                count = row['count']
-                
-                if disease not in self.disease_blood_corr:
-                    self.disease_blood_corr[disease] = {}
-                
-                self.disease_blood_corr[disease][blood_type] = count
-            
-            # Disease-Test Result correlations
-            disease_test_corr = datastore_df.groupby(['Disease', 'Test Result']).size().reset_index(name='count')
-            self.disease_test_corr = {}
-            for _, row in disease_test_corr.iterrows():
-                disease = int(row['Disease'])
-                test_result = int(row['Test Result'])
-                count = row['count']
-                
-                if disease not in self.disease_test_corr:
-                    self.disease_test_corr[disease] = {}
-                
-                self.disease_test_corr[disease][test_result] = count
-            
-            # Disease-Medication correlations
-            disease_med_corr = datastore_df.groupby(['Disease', 'Medication']).size().reset_index(name='count')
-            self.disease_med_corr = {}
-            for _, row in disease_med_corr.iterrows():
-                disease = int(row['Disease'])
-                medication = int(row['Medication'])
-                count = row['count']
-                
-                if disease not in self.disease_med_corr:
-                    self.disease_med_corr[disease] = {}
-                
-                self.disease_med_corr[disease][medication] = count
+            # Disease correlations with age bin, gender, blood type, test result and medication
+            self.disease_age_corr = datastore.crosstab('Age_Bin')
+            self.disease_gender_corr = datastore.crosstab('Gender')
+            self.disease_blood_corr = datastore.crosstab('Blood Type')
+            self.disease_test_corr = datastore.crosstab('Test Result')
+            self.disease_med_corr = datastore.crosstab('Medication')
             
             # Average billing amount per disease
-            disease_billing = datastore_df.groupby('Disease')['Billing Amount'].mean().reset_index()
-            self.disease_billing = {}
-            for _, row in disease_billing.iterrows():
-                disease = int(row['Disease'])
-                amount = row['Billing Amount']
-                self.disease_billing[disease] = amount
+            self.disease_billing = datastore.billing_means()
                 
             self.datastore_processed = True
-            print("Successfully processed datastore1.csv for medical report analysis")
+            print("Successfully processed datastore for medical report analysis")
         except Exception as e:
             print(f"Error processing datastore for medical report analysis: {e}")
     
-    def analyze_report(self, report_data):
+    def age_bin(self, age):
+        """Age bin code as used in age_bin_mapping"""
+        if age >= 50:
+            return 2
+        if age >= 30:
+            return 1
+        return 0
+    
+    def analyze_report(self, report):
         """
         Analyze medical report data
         
         Parameters:
-        report_data (dict): Contains patient data like age, gender, blood type, test results, etc.
+        report (ReportRequest): Validated patient data: age, gender, blood type, test result
         
         Returns:
         dict: Analysis results
@@ -425,72 +358,70 @@ class MedicalReportAnalyzer:
                 "error": "Datastore not processed, unable to perform analysis"
             }
         
-        age = report_data.get('age', 30)
-        gender = report_data.get('gender', 0)  # Default to female
-        blood_type = report_data.get('bloodType')
-        test_result = report_data.get('testResult')
+        age = report.age
+        gender = report.gender
+        blood_type = report.blood_type
+        test_result = report.test_result
         
         # Map age to age bin
-        age_bin = 0
-        if age >= 50:
-            age_bin = 2
-        elif age >= 30:
-            age_bin = 1
+        age_bin = self.age_bin(age)
         
         # Calculate disease probabilities based on correlations
-        disease_probabilities = {}
-        for disease in range(5):  # 5 diseases in our mapping
-            probability = 50  # Base probability
-            factors = []
-            
-            # Age factor
-            if disease in self.disease_age_corr and age_bin in self.disease_age_corr[disease]:
-                age_factor = self.disease_age_corr[disease][age_bin]
-                probability += min(20, age_factor * 5)
-                factors.append(f"Age group {self.age_bin_mapping[age_bin]}")
-            
-            # Gender factor
-            if disease in self.disease_gender_corr and gender in self.disease_gender_corr[disease]:
-                gender_factor = self.disease_gender_corr[disease][gender]
-                probability += min(15, gender_factor * 3)
-                factors.append(f"Gender: {'Male' if gender == 1 else 'Female'}")
-            
-            # Blood type factor
-            if blood_type is not None and disease in self.disease_blood_corr and blood_type in self.disease_blood_corr[disease]:
-                blood_factor = self.disease_blood_corr[disease][blood_type]
-                probability += min(10, blood_factor * 2)
-                factors.append(f"Blood type: {self.blood_type_mapping[blood_type]}")
-            
-            # Test result factor
-            if test_result is not None and disease in self.disease_test_corr and test_result in self.disease_test_corr[disease]:
-                test_factor = self.disease_test_corr[disease][test_result]
-                probability += min(25, test_factor * 8)
-                factors.append(f"Test result: {'Positive' if test_result == 1 else 'Negative'}")
-            
-            # Cap probability
-            probability = min(95, max(5, probability))
-            
-            # Store disease probability and factors
-            disease_name = self.disease_mapping[disease]
-            disease_probabilities[disease_name] = {
-                "probability": round(probability + np.random.uniform(-5, 5), 1),
-                "factors": factors
-            }
+        with span("datastore_lookup"):
+            disease_probabilities = {}
+            for disease in range(5):  # 5 diseases in our mapping
+                probability = 50  # Base probability
+                factors = []
+                
+                # Age factor
+                if disease in self.disease_age_corr and age_bin in self.disease_age_corr[disease]:
+                    age_factor = self.disease_age_corr[disease][age_bin]
+                    probability += min(20, age_factor * 5)
+                    factors.append(f"Age group {self.age_bin_mapping[age_bin]}")
+                
+                # Gender factor
+                if disease in self.disease_gender_corr and gender in self.disease_gender_corr[disease]:
+                    gender_factor = self.disease_gender_corr[disease][gender]
+                    probability += min(15, gender_factor * 3)
+                    factors.append(f"Gender: {'Male' if gender == 1 else 'Female'}")
+                
+                # Blood type factor
+                if blood_type is not None and disease in self.disease_blood_corr and blood_type in self.disease_blood_corr[disease]:
+                    blood_factor = self.disease_blood_corr[disease][blood_type]
+                    probability += min(10, blood_factor * 2)
+                    factors.append(f"Blood type: {self.blood_type_mapping[blood_type]}")
+                
+                # Test result factor
+                if test_result is not None and disease in self.disease_test_corr and test_result in self.disease_test_corr[disease]:
+                    test_factor = self.disease_test_corr[disease][test_result]
+                    probability += min(25, test_factor * 8)
+                    factors.append(f"Test result: {'Positive' if test_result == 1 else 'Negative'}")
+                
+                # Cap probability
+                probability = min(95, max(5, probability))
+                
+                # Store disease probability and factors
+                disease_name = self.disease_mapping[disease]
+                disease_probabilities[disease_name] = {
+                    "probability": round(probability + np.random.uniform(-5, 5), 1),
+                    "factors": factors
+                }
         
-        # Sort diseases by probability
-        sorted_diseases = sorted(
-            disease_probabilities.items(),
-            key=lambda x: x[1]["probability"],
-            reverse=True
-        )
+            # Sort diseases by probability
+            sorted_diseases = sorted(
+                disease_probabilities.items(),
+                key=lambda x: x[1]["probability"],
+                reverse=True
+            )
         
         # Get medical knowledge for top diseases
         medical_knowledge = []
-        for disease_name, _ in sorted_diseases[:2]:
-            # Convert to key format for medical_knowledge_db
-            disease_key = disease_name.lower().replace(" ", "_")
-            if disease_key in medical_knowledge_db:
-                medical_knowledge.append(medical_knowledge_db[disease_key])
+        with span("knowledge_join"):
+            for disease_name, _ in sorted_diseases[:2]:
+                # Convert to key format for medical_knowledge_db
+                disease_key = disease_name.lower().replace(" ", "_")
+                if disease_key in medical_knowledge_db:
+                    medical_knowledge.append(medical_knowledge_db[disease_key])
         
         # Generate recommended follow-ups based on top disease
         top_disease = sorted_diseases[0][0] if sorted_diseases else None
@@ -577,9 +508,28 @@ class MedicalReportAnalyzer:
 symptom_analyzer = EnhancedSymptomAnalyzer()
 report_analyzer = MedicalReportAnalyzer()
 
+# Columnar bitmap index over the datastore for cohort queries
+cohort_index = None
+if HAS_DATASTORE:
+    try:
+        cohort_index = CohortIndex(datastore.columns)
+        print(f"Built cohort index over {cohort_index.num_rows} records")
+    except Exception as e:
+        print(f"Error building cohort index: {e}")
+
+# Rolling statistics over analysed reports, kept in fixed-size sketches
+live_stats = LiveStats(
+    ("healthScore", "billingAmount"),
+    bucket_seconds=int(os.environ.get("LIVE_STATS_BUCKET_SECONDS", 60)),
+    buckets=int(os.environ.get("LIVE_STATS_BUCKETS", 60)),
+    spool_dir=os.environ.get("LIVE_STATS_DIR") or None
+)
+
 # Mock mental health chatbot
 class MockMentalHealthChatbot:
-    def __init__(self):
+    def __init__(self, model=None):
+        # Optional text-generation InferenceModel; without one, replies are rule based
+        self.model = model
         # Simple rule-based responses for demo purposes
         self.responses = {
             "anxiety": [
@@ -610,59 +560,59 @@ class MockMentalHealthChatbot:
             "That sounds challenging. Remember that seeking help is a sign of strength, not weakness.",
             "Your feelings are valid. Would it help to talk about specific situations that trigger these feelings?"
         ]
+        # Every fixed reply; the session store keeps one shared copy of each
+        self.canned_replies = [reply for replies in self.responses.values() for reply in replies]
+        self.canned_replies += self.default_responses
     
-    def get_response(self, user_input):
+    def get_response(self, user_input, history=None):
+        """
+        Reply to a message. `history` holds the session's earlier (role, text) turns;
+        the rule-based mock ignores it, a real companion model conditions on it.
+        """
+        if self.model is not None:
+            prompt = "".join(f"{role}: {text}\n" for role, text in (history or []))
+            prompt += f"user: {user_input}\nassistant:"
+            with span("inference", model=self.model.model_id, backend=self.model.backend):
+                generated = self.model(prompt, max_new_tokens=80, return_full_text=False)[0]["generated_text"]
+            reply = generated.strip().split("\n")[0].strip()
+            if reply:
+                return reply
+        
         user_input = user_input.lower()
         
         for topic, responses in self.responses.items():
             if topic in user_input:
-                return np.random.choice(responses)
+                return random.choice(responses)
         
-        return np.random.choice(self.default_responses)
+        return random.choice(self.default_responses)
 
 # Initialize mock mental health chatbot
-mental_health_chatbot = MockMentalHealthChatbot()
+mental_health_chatbot = MockMentalHealthChatbot(chat_model)
+
+# Per-session conversation history for the chatbot
+chat_sessions = SessionStore(
+    max_turns=int(os.environ.get("CHAT_MAX_TURNS", 20)),
+    max_tokens=int(os.environ.get("CHAT_MAX_TOKENS", 1000)),
+    max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", 10000)),
+    max_memory_bytes=int(os.environ.get("CHAT_MEMORY_MB", 64)) * 1024 * 1024,
+    ttl_seconds=int(os.environ.get("CHAT_SESSION_TTL", 1800)),
+    spill_dir=os.environ.get("CHAT_SPILL_DIR"),
+    shared_texts=mental_health_chatbot.canned_replies,
+    # Processes sharing CHAT_SPILL_DIR (prefork workers) share sessions through it
+    shared=os.environ.get("CHAT_SHARED_SESSIONS") == "1" and bool(os.environ.get("CHAT_SPILL_DIR"))
+)
 
 # Add a class for prescription analysis
 class PrescriptionAnalyzer:
+    # Bump whenever analysis output changes, so cached results of older versions aren't reused
+    VERSION = 1
+
     def __init__(self):
-        self.common_medications = {
-            "amoxicillin": {
-                "category": "antibiotic",
-                "common_dosages": ["250mg", "500mg"],
-                "interactions": ["alcohol", "warfarin", "methotrexate"],
-                "side_effects": ["diarrhea", "nausea", "rash"],
-                "contraindications": ["penicillin allergy"]
-            },
-            "atorvastatin": {
-                "category": "statin",
-                "common_dosages": ["10mg", "20mg", "40mg", "80mg"],
-                "interactions": ["grapefruit", "cyclosporine", "gemfibrozil"],
-                "side_effects": ["muscle pain", "headache", "digestive issues"],
-                "contraindications": ["liver disease", "pregnancy"]
-            },
-            "metformin": {
-                "category": "antidiabetic",
-                "common_dosages": ["500mg", "850mg", "1000mg"],
-                "interactions": ["alcohol", "iodinated contrast media"],
-                "side_effects": ["diarrhea", "nausea", "abdominal pain"],
-                "contraindications": ["kidney disease", "metabolic acidosis"]
-            },
-            "paracetamol": {
-                "category": "analgesic",
-                "common_dosages": ["500mg", "650mg"],
-                "interactions": ["warfarin", "alcohol"],
-                "side_effects": ["liver damage (in overdose)"],
-                "contraindications": ["liver disease"]
-            },
-            "lisinopril": {
-                "category": "ACE inhibitor",
-                "common_dosages": ["5mg", "10mg", "20mg"],
-                "interactions": ["potassium supplements", "spironolactone"],
-                "side_effects": ["dry cough", "dizziness", "headache"],
-                "contraindications": ["pregnancy", "history of angioedema"]
-            }
-        }
+        # Formulary, compiled from data/medications.json like the knowledge base
+        self.common_medications = load_knowledge("medications.json")
+        # Identifies the analysis logic and formulary in the prescription cache key; the
+        # formulary digest comes from the compiled store's header, not from reading it
+        self.version = f"{self.VERSION}-{self.common_medications.digest[:12]}"
         
         self.common_diagnoses = [
             "hypertension", "diabetes", "bacterial infection", 
@@ -788,6 +738,15 @@ class PrescriptionAnalyzer:
 # Initialize the prescription analyzer
 prescription_analyzer = PrescriptionAnalyzer()
 
+# Analysis results for previously seen prescription images (exact and near-duplicate copies)
+prescription_cache = PrescriptionCache(
+    os.environ.get("PRESCRIPTION_CACHE_DIR", "prescription_cache") or None,
+    max_entries=int(os.environ.get("PRESCRIPTION_CACHE_ENTRIES", 1024)),
+    max_disk_bytes=int(os.environ.get("PRESCRIPTION_CACHE_DISK_MB", 256)) * 1024 * 1024,
+    max_distance=int(os.environ.get("PRESCRIPTION_CACHE_MAX_DISTANCE", 0)),
+    version=prescription_analyzer.version
+)
+
 # Create upload folder if it doesn't exist
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
@@ -796,7 +755,159 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
+# Admission control: per-client token buckets plus a cap on requests in flight per class
+ADMISSION_CLASSES = {
+    "upload": {"rate": 0.5, "burst": 5, "concurrency": 4},
+    "chat": {"rate": 1.0, "burst": 10, "concurrency": 16}
+}
+ADMISSION_ENDPOINTS = {
+    "analyze_prescription": "upload",
+    "submit_job": "upload",
+    "mental_health_chat": "chat"
+}
+
+# Comma separated keys clients may send in X-API-Key to get their own rate limit buckets;
+# requests with any other key are rejected
+API_KEYS = load_api_keys(os.environ.get("API_KEYS"))
+
+# Set RATE_LIMIT_SHARED_FILE (e.g. /dev/shm/arogya-limits) to share limits across worker processes
+if os.environ.get("RATE_LIMIT_SHARED_FILE"):
+    admission_backend = SharedMemoryBackend(os.environ["RATE_LIMIT_SHARED_FILE"])
+else:
+    admission_backend = LocalBackend()
+admission_controller = AdmissionController(admission_backend, ADMISSION_CLASSES, ADMISSION_ENDPOINTS, api_keys=API_KEYS)
+
+# Request tracing; off unless TRACE_SAMPLE_RATE or TRACE_SLOW_MS is set
+tracer = Tracer(
+    sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 0)),
+    slow_threshold_ms=float(os.environ["TRACE_SLOW_MS"]) if os.environ.get("TRACE_SLOW_MS") else None,
+    buffer_size=int(os.environ.get("TRACE_BUFFER_SIZE", 256)),
+    exporter=FileExporter(os.environ["TRACE_EXPORT_DIR"], "arogya-backend") if os.environ.get("TRACE_EXPORT_DIR") else None
+)
+# Registered first so time spent in admission control is part of the trace
+tracer.init_app(app)
+admission_controller.init_app(app)
+
+# Bulk analysis jobs
+# Report jobs take a CSV with datastore1.csv style columns (or the /api/analyze-report
+# field names); prescription jobs take a zip of prescription images
+REPORT_CSV_FIELDS = {
+    "Age": "age",
+    "Gender": "gender",
+    "Blood Type": "bloodType",
+    "Test Result": "testResult"
+}
+PRESCRIPTION_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+def read_report_records(path):
+    # Rows are yielded as read; coercing and validating happens per row in
+    # process_report_record, so a bad cell fails its own row rather than the reader
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {
+                REPORT_CSV_FIELDS.get(column, column): value
+                for column, value in row.items()
+                if column is not None and REPORT_CSV_FIELDS.get(column, column) in REPORT_CSV_FIELDS.values()
+                and value not in (None, "")
+            }
+
+def process_report_record(record):
+    # Rows are validated one at a time so a bad row fails on its own, not the whole job
+    fields = {}
+    for field, value in record.items():
+        try:
+            fields[field] = int(float(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {field}: {value!r}")
+    return report_analyzer.analyze_report(convert(fields, ReportRequest))
+
+def count_report_records(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return max(0, sum(1 for _ in csv.reader(f)) - 1)
+
+def _prescription_entries(archive):
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in PRESCRIPTION_IMAGE_EXTENSIONS
+    ]
+
+# Decompressed size limits for prescription zips, so a small zip bomb can't exhaust memory
+PRESCRIPTION_ZIP_MAX_ENTRY_BYTES = int(os.environ.get("PRESCRIPTION_ZIP_MAX_ENTRY_MB", 16)) * 1024 * 1024
+PRESCRIPTION_ZIP_MAX_TOTAL_BYTES = int(os.environ.get("PRESCRIPTION_ZIP_MAX_TOTAL_MB", 1024)) * 1024 * 1024
+
+def read_prescription_records(path):
+    """Yield (file name, image bytes, error); an entry over the limits or unreadable only fails its own record"""
+    total = 0
+    with zipfile.ZipFile(path) as archive:
+        for info in _prescription_entries(archive):
+            limit = min(PRESCRIPTION_ZIP_MAX_ENTRY_BYTES, PRESCRIPTION_ZIP_MAX_TOTAL_BYTES - total)
+            if info.file_size > limit:
+                yield info.filename, None, f"Entry exceeds the size limit ({info.file_size} bytes)"
+                continue
+            try:
+                # The header's size can be forged, so never decompress more than the limit
+                with archive.open(info) as entry:
+                    image_bytes = entry.read(limit + 1)
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError, OSError, EOFError, zlib.error) as e:
+                yield info.filename, None, f"Unreadable entry: {e}"
+                continue
+            if len(image_bytes) > limit:
+                yield info.filename, None, "Entry exceeds the size limit"
+                continue
+            total += len(image_bytes)
+            yield info.filename, image_bytes, None
+
+def count_prescription_records(path):
+    with zipfile.ZipFile(path) as archive:
+        return len(_prescription_entries(archive))
+
+def analyze_prescription_bytes(name, image_bytes):
+    """
+    Analyze an uploaded prescription image, reusing the result for a previously seen copy
+
+    Returns:
+    tuple: (analysis result, cache status from PrescriptionCache.lookup)
+    """
+    with span("cache_lookup", bytes=len(image_bytes)) as lookup_span:
+        result, status, key = prescription_cache.lookup(image_bytes)
+        lookup_span.set_attribute("cache.status", status)
+    if result is not None:
+        return result, status
+    
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{secure_filename(os.path.basename(name))}")
+    with span("file_save"):
+        with open(file_path, "wb") as f:
+            f.write(image_bytes)
+    try:
+        with span("inference", model="prescription-ocr"):
+            result = prescription_analyzer.analyze_prescription_image(file_path)
+    finally:
+        with span("file_remove"):
+            os.remove(file_path)
+    prescription_cache.store(key, result)
+    return result, status
+
+def process_prescription_record(record):
+    name, image_bytes, error = record
+    if error is not None:
+        raise ValueError(error)
+    result, _ = analyze_prescription_bytes(name, image_bytes)
+    return dict(result, fileName=name)
+
+job_queue = JobQueue(
+    os.environ.get("JOB_STORAGE_DIR", "jobs"),
+    concurrency=int(os.environ.get("JOB_CONCURRENCY", 2)),
+    chunk_size=int(os.environ.get("JOB_CHUNK_SIZE", 100))
+)
+job_queue.register("report", read_report_records, process_report_record, count_report_records)
+job_queue.register("prescription", read_prescription_records, process_prescription_record, count_prescription_records)
+
 # Routes
+@app.errorhandler(msgspec.DecodeError)
+def invalid_request_body(e):
+    # ValidationError is a DecodeError, so both malformed JSON and schema violations land here
+    return jsonify({"error": f"Invalid request body: {e}"}), 400
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     return jsonify({
@@ -808,9 +919,9 @@ def health_check():
 
 @app.route("/api/analyze-symptoms", methods=["POST"])
 def analyze_symptoms():
-    data = request.json
-    symptoms_text = data.get("symptoms", "")
-    user_info = data.get("userInfo", {})
+    body = decode(request.get_data(cache=False), SymptomRequest)
+    symptoms_text = body.symptoms
+    user_info = body.user_info
     
     if not symptoms_text:
         return jsonify({"error": "No symptoms provided"}), 400
@@ -818,90 +929,233 @@ def analyze_symptoms():
     analysis_results = symptom_analyzer.analyze(symptoms_text)
     
     # Calculate risk factors based on user info and datastore patterns
-    age = user_info.get("age", 30)
+    age = user_info.age
     age_risk = "high" if age > 60 else "medium" if age > 45 else "low"
     
     response = {
         "results": analysis_results,
         "user_risk_factors": {
             "age": age_risk,
-            "region": "medium" if user_info.get("region") in ["Mumbai", "Delhi", "Bangalore"] else "low",
-            "history": "high" if user_info.get("has_chronic_conditions", False) else "low"
+            "region": "medium" if user_info.region in ["Mumbai", "Delhi", "Bangalore"] else "low",
+            "history": "high" if user_info.has_chronic_conditions else "low"
         }
     }
     
+    if symptom_model is not None:
+        with span("inference", model=symptom_model.model_id, backend=symptom_model.backend):
+            predictions = symptom_model(symptoms_text, top_k=3)
+        response["model_predictions"] = [
+            {"condition": prediction["label"], "confidence": round(prediction["score"] * 100, 1)}
+            for prediction in predictions
+        ]
+    
     return jsonify(response)
 
 @app.route("/api/analyze-report", methods=["POST"])
 def analyze_report():
     """Endpoint for analyzing medical report data using datastore1.csv"""
-    data = request.json
-    
-    if not data:
-        return jsonify({"error": "No report data provided"}), 400
+    with span("parse"):
+        body = request.get_data(cache=False)
+        # Only an empty body or object is missing data; fields equal to the defaults are valid
+        if body.translate(None, b" \t\r\n") in (b"", b"{}", b"null"):
+            return jsonify({"error": "No report data provided"}), 400
+        report = decode(body, ReportRequest)
     
     # Perform analysis
-    analysis_result = report_analyzer.analyze_report(data)
+    analysis_result = report_analyzer.analyze_report(report)
     
-    return jsonify(analysis_result)
+    if "error" not in analysis_result:
+        with span("live_stats"):
+            live_stats.record(
+                {
+                    "ageBin": report_analyzer.age_bin(report.age),
+                    "gender": report.gender,
+                    "bloodType": report.blood_type,
+                    "testResult": report.test_result,
+                    "highRisk": int(any(flag["priority"] == "high" for flag in analysis_result["warningFlags"]))
+                },
+                {"healthScore": analysis_result["healthScore"], "billingAmount": report.billing_amount},
+                # Unknown keys aren't rejected here, so count those clients by address
+                distinct=client_key(request, API_KEYS) or client_identity(None, request.remote_addr, API_KEYS)
+            )
+    
+    with span("serialize"):
+        return jsonify(analysis_result)
+
+def _page_args():
+    """Read the optional cursor/limit pagination query parameters"""
+    limit = request.args.get("limit", type=int)
+    if "limit" in request.args and (limit is None or limit < 1):
+        raise ValueError("limit must be a positive integer")
+    return request.args.get("cursor"), limit
+
+def _disease_info_record(disease_id):
+    """Build the disease-info entry for one disease"""
+    # Build prevalence data
+    prevalence = []
+    if disease_id in report_analyzer.disease_age_corr:
+        for age_bin, count in report_analyzer.disease_age_corr[disease_id].items():
+            prevalence.append({
+                "ageGroup": report_analyzer.age_bin_mapping[age_bin],
+                "count": int(count)
+            })
+    
+    # Build blood type correlation
+    blood_correlation = []
+    if disease_id in report_analyzer.disease_blood_corr:
+        for blood_type, count in report_analyzer.disease_blood_corr[disease_id].items():
+            blood_correlation.append({
+                "bloodType": report_analyzer.blood_type_mapping[blood_type],
+                "count": int(count)
+            })
+    
+    return {
+        "id": disease_id,
+        "name": report_analyzer.disease_mapping[disease_id],
+        "prevalence": prevalence,
+        "bloodTypeCorrelation": blood_correlation
+    }
 
 @app.route("/api/disease-info", methods=["GET"])
 def get_disease_info():
-    """Endpoint to get disease information from the dataset"""
+    """Endpoint to get disease information from the dataset (JSON array or streamed NDJSON)"""
     if not HAS_DATASTORE:
         return jsonify({"error": "Datastore not available"}), 503
     
-    result = []
-    for disease_id, disease_name in report_analyzer.disease_mapping.items():
-        # Build prevalence data
-        prevalence = []
-        if disease_id in report_analyzer.disease_age_corr:
-            for age_bin, count in report_analyzer.disease_age_corr[disease_id].items():
-                prevalence.append({
-                    "ageGroup": report_analyzer.age_bin_mapping[age_bin],
-                    "count": count
-                })
+    try:
+        cursor, limit = _page_args()
+        disease_ids, next_cursor = paginate(sorted(report_analyzer.disease_mapping), cursor, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Records are built one at a time as the response is written
+    records = (_disease_info_record(disease_id) for disease_id in disease_ids)
+    return list_response(request, records, next_cursor)
+
+@app.route("/api/cohort-stats", methods=["GET"])
+def get_cohort_stats():
+    """Endpoint for cohort statistics filtered by age range, gender, blood type, disease and medication"""
+    if cohort_index is None:
+        return jsonify({"error": "Datastore not available"}), 503
+    
+    label_mappings = {
+        "gender": {0: "Female", 1: "Male"},
+        "bloodType": report_analyzer.blood_type_mapping,
+        "disease": report_analyzer.disease_mapping,
+        "medication": None
+    }
+    
+    try:
+        min_age = request.args.get("minAge", type=int)
+        max_age = request.args.get("maxAge", type=int)
+        if ("minAge" in request.args and min_age is None) or ("maxAge" in request.args and max_age is None):
+            raise ValueError("Age bounds must be integers")
         
-        # Build blood type correlation
-        blood_correlation = []
-        if disease_id in report_analyzer.disease_blood_corr:
-            for blood_type, count in report_analyzer.disease_blood_corr[disease_id].items():
-                blood_correlation.append({
-                    "bloodType": report_analyzer.blood_type_mapping[blood_type],
-                    "count": count
+        filters = {}
+        for name in CATEGORICAL_COLUMNS:
+            if name in request.args:
+                filters[name] = parse_filter_values(request.args[name], label_mappings[name])
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    
+    started = time.perf_counter()
+    stats = cohort_index.query(min_age=min_age, max_age=max_age, **filters)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    return jsonify({
+        "count": stats["count"],
+        "totalRecords": cohort_index.num_rows,
+        "billing": stats["billing"],
+        "medicationDistribution": [
+            {"medication": medication, "count": count}
+            for medication, count in stats["medication"].items()
+        ],
+        "diseaseDistribution": [
+            {"disease": report_analyzer.disease_mapping.get(disease, f"Unknown Disease {disease}"), "count": count}
+            for disease, count in stats["disease"].items()
+        ],
+        "queryTimeMs": round(elapsed_ms, 3)
+    })
+
+@app.route("/api/live-stats", methods=["GET"])
+def get_live_stats():
+    """Endpoint for rolling population statistics over recently analysed reports, across all workers"""
+    max_minutes = live_stats.bucket_seconds * len(live_stats.ring) // 60
+    window_minutes = request.args.get("windowMinutes", min(15, max_minutes), type=int)
+    if window_minutes is None or not 1 <= window_minutes <= max_minutes:
+        return jsonify({"error": f"windowMinutes must be between 1 and {max_minutes}"}), 400
+    
+    merged, workers = live_stats.snapshot(window_minutes * 60)
+    
+    def count(**categories):
+        # Count-min estimates can only over-count, so cap them at the window total
+        return min(merged.count, merged.cms.estimate(category_key(**categories)))
+    
+    def breakdown(field, labels):
+        rows = []
+        for code, label in labels.items():
+            reports = count(**{field: code})
+            if reports:
+                high_risk = min(reports, count(**{field: code, "highRisk": 1}))
+                rows.append({
+                    field: label,
+                    "reports": reports,
+                    "highRisk": high_risk,
+                    "highRiskRate": round(high_risk / reports, 4),
+                    "positiveTests": min(reports, count(**{field: code, "testResult": 1}))
                 })
-        
-        result.append({
-            "id": disease_id,
-            "name": disease_name,
-            "prevalence": prevalence,
-            "bloodTypeCorrelation": blood_correlation
-        })
+        return rows
     
-    return jsonify(result)
+    def distribution(name):
+        digest = merged.digests[name]
+        if digest.count == 0:
+            return {"count": 0}
+        return {
+            "count": digest.count,
+            "min": round(digest.min, 2),
+            "p50": round(digest.quantile(0.5), 2),
+            "p90": round(digest.quantile(0.9), 2),
+            "p99": round(digest.quantile(0.99), 2),
+            "max": round(digest.max, 2)
+        }
+    
+    high_risk = count(highRisk=1)
+    return jsonify({
+        "windowMinutes": window_minutes,
+        "reports": merged.count,
+        "distinctClients": merged.hll.estimate(),
+        "highRiskRate": round(high_risk / merged.count, 4) if merged.count else 0.0,
+        "byAgeBin": breakdown("ageBin", report_analyzer.age_bin_mapping),
+        "byGender": breakdown("gender", {0: "Female", 1: "Male"}),
+        "byBloodType": breakdown("bloodType", report_analyzer.blood_type_mapping),
+        "healthScore": distribution("healthScore"),
+        "billingAmount": distribution("billingAmount"),
+        "workersMerged": workers + 1,
+        "sketchMemoryBytes": live_stats.memory_bytes()
+    })
 
 @app.route("/api/medical-knowledge", methods=["GET"])
 def get_medical_knowledge():
-    """Endpoint to get medical knowledge base entries"""
+    """Endpoint to get medical knowledge base entries (JSON array or streamed NDJSON)"""
     query = request.args.get("query", "").lower()
     
-    if query:
-        # Filter knowledge by query
-        results = []
-        for key, data in medical_knowledge_db.items():
-            if (query in key or 
-                query in data["name"].lower() or 
-                query in data["description"].lower()):
-                results.append(data)
-        return jsonify(results)
-    else:
-        # Return all knowledge entries
-        return jsonify(list(medical_knowledge_db.values()))
+    # Keys come back sorted; the query is matched against key, name and description
+    # without decoding records that don't match
+    matching_keys = medical_knowledge_db.search(query) if query else iter(medical_knowledge_db)
+    
+    try:
+        cursor, limit = _page_args()
+        keys, next_cursor = paginate(matching_keys, cursor, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return list_response(request, (medical_knowledge_db[key] for key in keys), next_cursor)
 
 @app.route("/api/mental-health/chat", methods=["POST"])
 def mental_health_chat():
-    data = request.json
-    user_message = data.get("message", "")
+    body = decode(request.get_data(cache=False), ChatRequest)
+    user_message = body.message
+    session_id = body.session_id or str(uuid.uuid4())
     
     if not user_message:
         return jsonify({"error": "No message provided"}), 400
@@ -909,13 +1163,29 @@ def mental_health_chat():
     # Simulate processing delay
     time.sleep(1)
     
-    response = mental_health_chatbot.get_response(user_message)
+    history = chat_sessions.history(session_id)
+    response = mental_health_chatbot.get_response(user_message, history)
+    chat_sessions.append(session_id, "user", user_message)
+    chat_sessions.append(session_id, "assistant", response)
     
     return jsonify({
         "response": response,
+        "sessionId": session_id,
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route("/api/mental-health/sessions/<session_id>", methods=["DELETE"])
+def end_chat_session(session_id):
+    """Endpoint for ending a chat session and discarding its history"""
+    if not chat_sessions.end(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({"sessionId": session_id, "ended": True})
+
+@app.route("/api/mental-health/sessions/stats", methods=["GET"])
+def chat_session_stats():
+    """Endpoint for chat session store occupancy and eviction metrics"""
+    return jsonify(chat_sessions.stats())
+
 @app.route("/api/analyze-prescription", methods=["POST"])
 def analyze_prescription():
     """Endpoint for analyzing prescription images"""
@@ -929,36 +1199,121 @@ def analyze_prescription():
     
     if file:
         # In a production system, we would validate file type and content more thoroughly
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
         try:
-            # Process the image and analyze prescription
-            analysis_result = prescription_analyzer.analyze_prescription_image(file_path)
-            
-            # Clean up the file after analysis (optional)
-            os.remove(file_path)
-            
-            return jsonify(analysis_result)
+            # Repeat uploads are answered from the cache before anything is written to disk
+            with span("parse"):
+                image_bytes = file.read()
+            analysis_result, cache_status = analyze_prescription_bytes(file.filename, image_bytes)
+            with span("serialize"):
+                response = jsonify(analysis_result)
+            response.headers["X-Prescription-Cache"] = cache_status
+            return response
         except Exception as e:
-            # Clean up in case of error
-            if os.path.exists(file_path):
-                os.remove(file_path)
             return jsonify({"error": f"Error analyzing prescription: {str(e)}"}), 500
     
     return jsonify({"error": "Invalid file"}), 400
 
+@app.route("/api/prescription-cache/stats", methods=["GET"])
+def prescription_cache_stats():
+    """Endpoint for prescription analysis cache occupancy and hit rates"""
+    return jsonify(prescription_cache.stats())
+
+@app.route("/api/admin/traces", methods=["GET"])
+def list_traces():
+    """Endpoint for recently kept request traces in this worker, newest first"""
+    limit = request.args.get("limit", 50, type=int)
+    min_duration = request.args.get("minDurationMs", 0, type=float)
+    return jsonify({
+        "enabled": tracer.enabled,
+        "sampleRate": tracer.sample_rate,
+        "slowThresholdMs": tracer.slow_threshold_ms,
+        **tracer.metrics,
+        "traces": tracer.recent_traces(limit, min_duration)
+    })
+
+@app.route("/api/admin/traces/<trace_id>", methods=["GET"])
+def get_trace(trace_id):
+    """Endpoint for one kept trace with all of its spans"""
+    trace = tracer.get_trace(trace_id)
+    if trace is None:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace)
+
+@app.route("/api/admin/ingest", methods=["GET"])
+def ingest_report():
+    """Endpoint for the datastore ingestion summary with per-shard timing and malformed row counts"""
+    if datastore is None:
+        return jsonify({"error": "Datastore not available"}), 503
+    return jsonify(dict(datastore.summary(), source=DATASTORE_PATH, shardReports=datastore.shards))
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """Endpoint for submitting a bulk report CSV or prescription image zip for background analysis"""
+    job_type = request.form.get("type", "")
+    if job_type not in job_queue.kinds:
+        return jsonify({"error": f"Job type must be one of: {', '.join(job_queue.kinds)}"}), 400
+    
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({"error": "No file provided"}), 400
+    
+    file = request.files['file']
+    try:
+        job_id = job_queue.submit(job_type, file, secure_filename(file.filename))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(job_queue.get(job_id)), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Endpoint for polling job status, progress and throughput"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/api/jobs/<job_id>/results", methods=["GET"])
+def get_job_results(job_id):
+    """Endpoint for reading job results as NDJSON, optionally from a line offset while the job runs"""
+    results_path = job_queue.results_path(job_id)
+    if results_path is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not os.path.exists(results_path):
+        return Response("", mimetype=NDJSON_MIMETYPE)
+    
+    offset = request.args.get("offset", 0, type=int)
+    if offset <= 0:
+        return send_file(
+            os.path.abspath(results_path),
+            mimetype=NDJSON_MIMETYPE,
+            as_attachment=request.args.get("download") == "1",
+            download_name=f"{job_id}.ndjson"
+        )
+    
+    def generate():
+        with open(results_path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f):
+                # Only complete lines; a chunk may be mid-write
+                if line_number >= offset and line.endswith("\n"):
+                    yield line
+    
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
 # This would run in a production environment
 if __name__ == "__main__":
     print("Starting ArogyaAI+ Backend Server...")
     print(f"ML Libraries Available: {HAS_ML_LIBS}")
     
-    # In a real app, you would initialize ML models here
+    # Models configured with SYMPTOM_MODEL / CHAT_MODEL are prepared at import
     if HAS_ML_LIBS:
-        print("Loading NLP models...")
-        # Example:
-        # symptom_analyzer = pipeline("text-classification", model="healthcare/symptom-analysis")
-        # mental_health_model = pipeline("text-generation", model="healthcare/mental-health-support")
+        print(f"Symptom model: {symptom_model.model_id if symptom_model else 'rule-based'}")
+        print(f"Chat model: {chat_model.model_id if chat_model else 'rule-based'}")
+    
+    debug_mode = True
+    
+    # With the debug reloader, only the serving child process runs background workers
+    if not debug_mode or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        job_queue.start()
+        live_stats.start()
     
-    app.run(debug=True, port=5000)
+    app.run(debug=debug_mode, port=5000)
@@ -0,0 +1,396 @@
+# Bounded conversation history for the mental health chatbot
+# Each session keeps its most recent turns within a per-session turn/token budget.
+# Sessions are kept in LRU order with a TTL, and the store as a whole is capped by an
+# estimated memory budget; sessions pushed out by the caps (or idle for a while) can be
+# spilled to local disk and are restored transparently on their next message.
+# In shared mode every turn is also written to the spill directory, which then holds the
+# authoritative copy, so several processes (e.g. prefork workers) see the same history.
+# The memory cap covers only sessions held in this process; spill files are bounded by the
+# TTL, which is enforced on the directory's contents so files of exited processes expire too.
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Approximate CPython sizes, used to estimate memory without calling sys.getsizeof per turn
+TURN_OVERHEAD_BYTES = 120
+SESSION_OVERHEAD_BYTES = 400
+
+# Idle sessions are only swept this often, so the sweep cost is amortised across requests
+SWEEP_INTERVAL_SECONDS = 10
+
+
+def count_tokens(text):
+    """Cheap whitespace token estimate; real tokenizers land within a small factor of this"""
+    return len(text.split())
+
+
+class Turn:
+    __slots__ = ("role", "text", "tokens", "timestamp")
+
+    def __init__(self, role, text, tokens, timestamp):
+        self.role = role
+        self.text = text
+        self.tokens = tokens
+        self.timestamp = timestamp
+
+    def size(self):
+        return TURN_OVERHEAD_BYTES + len(self.text)
+
+
+class Session:
+    __slots__ = ("session_id", "turns", "tokens", "size", "last_access", "disk_version")
+
+    def __init__(self, session_id, last_access):
+        self.session_id = session_id
+        self.turns = deque()
+        self.tokens = 0
+        self.size = SESSION_OVERHEAD_BYTES + len(session_id)
+        self.last_access = last_access
+        # Identity of the spill file this copy matches, in shared mode
+        self.disk_version = None
+
+
+def _file_version(stat):
+    # Files are replaced rather than rewritten, so a new inode means a new version
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class SessionStore:
+    def __init__(self, max_turns=20, max_tokens=1000, max_sessions=10000,
+                 max_memory_bytes=64 * 1024 * 1024, ttl_seconds=1800,
+                 spill_dir=None, spill_after_seconds=300, shared=False, shared_texts=()):
+        """
+        Parameters:
+        max_turns, max_tokens (int): Per-session budget; the oldest turns are dropped first
+        max_sessions (int): Maximum sessions held in memory
+        max_memory_bytes (int): Estimated memory cap across all in-memory sessions
+        ttl_seconds (int): Sessions idle for longer are forgotten, in memory and on disk
+        spill_dir (str): If set, evicted and idle sessions are written here instead of dropped
+        spill_after_seconds (int): Idle time after which an in-memory session is spilled
+        shared (bool): Write every turn to spill_dir and treat it as the authoritative copy,
+        so processes sharing the directory share sessions (requires spill_dir)
+        shared_texts (iterable): Texts that recur across sessions, such as canned bot replies;
+        turns with one of these texts reference a single copy of it
+        """
+        if shared and not spill_dir:
+            raise ValueError("A shared session store needs a spill directory")
+        if max_memory_bytes <= 0:
+            raise ValueError("The session memory cap must be positive")
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.spill_after_seconds = spill_after_seconds
+        self.shared = shared
+        # Only a fixed set of texts is shared; interning every reply would grow without bound
+        # once replies are generated
+        self._shared_texts = {text: text for text in shared_texts}
+
+        self.sessions = OrderedDict()
+        self.memory_bytes = 0
+        self.total_turns = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+        # Spilled sessions by file name -> last access time
+        self._spilled = {}
+        # Total size of the spill directory as of the last sweep, in shared mode
+        self.spilled_bytes = 0
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "spills": 0,
+            "restores": 0,
+            "evictions": {"lru": 0, "memory": 0, "ttl": 0},
+            "trimmedTurns": 0
+        }
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            for entry in os.scandir(spill_dir):
+                if entry.name.endswith(".json"):
+                    self._spilled[entry.name] = entry.stat().st_mtime
+
+    def append(self, session_id, role, text):
+        """Record a turn, creating or restoring the session as needed"""
+        now = time.time()
+        # Roles and canned replies repeat across sessions, so share a single copy of each
+        role = sys.intern(str(role))
+        text = str(text)
+        text = self._shared_texts.get(text, text)
+        turn = Turn(role, text, count_tokens(text), now)
+
+        with self._lock:
+            session = self._get(session_id, now, create=True)
+            session.turns.append(turn)
+            session.tokens += turn.tokens
+            session.size += turn.size()
+            self.total_turns += 1
+            self.total_tokens += turn.tokens
+            self.memory_bytes += turn.size()
+
+            while len(session.turns) > 1 and (
+                    len(session.turns) > self.max_turns or session.tokens > self.max_tokens):
+                self._drop_turn(session)
+                self.metrics["trimmedTurns"] += 1
+
+            if self.shared:
+                self._spill(session)
+            self._enforce_caps()
+            self._maybe_sweep(now)
+        return turn
+
+    def history(self, session_id):
+        """Return the session's turns as (role, text) pairs, oldest first"""
+        now = time.time()
+        with self._lock:
+            session = self._get(session_id, now, create=False)
+            if session is None:
+                return []
+            # A restored session counts against the caps like any other
+            self._enforce_caps()
+            return [(turn.role, turn.text) for turn in session.turns]
+
+    def end(self, session_id):
+        """Forget a session entirely"""
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                self._release(session)
+            name = self._spill_name(session_id)
+            spilled = name in self._spilled or (self.shared and os.path.exists(os.path.join(self.spill_dir, name)))
+            self._remove_spilled(name)
+            return session is not None or spilled
+
+    def stats(self):
+        with self._lock:
+            self._maybe_sweep(time.time())
+            return {
+                "sessionsInMemory": len(self.sessions),
+                "sessionsSpilled": len(self._spilled),
+                # Not counted against maxMemoryBytes, although a tmpfs spill directory is in RAM
+                "spilledBytes": self.spilled_bytes if self.shared else None,
+                "turns": self.total_turns,
+                "tokens": self.total_tokens,
+                "estimatedMemoryBytes": self.memory_bytes,
+                "maxMemoryBytes": self.max_memory_bytes,
+                "memoryOccupancy": round(self.memory_bytes / self.max_memory_bytes, 4),
+                "maxSessions": self.max_sessions,
+                "hits": self.metrics["hits"],
+                "misses": self.metrics["misses"],
+                "spills": self.metrics["spills"],
+                "restores": self.metrics["restores"],
+                "evictions": dict(self.metrics["evictions"]),
+                "trimmedTurns": self.metrics["trimmedTurns"]
+            }
+
+    def _get(self, session_id, now, create):
+        session = self.sessions.get(session_id)
+        if session is not None and now - session.last_access > self.ttl_seconds:
+            self._evict(session, "ttl", spill=False)
+            session = None
+        if session is not None and self.shared and not self._is_current(session):
+            # Another process has since written this session, or ended it
+            del self.sessions[session_id]
+            self._release(session)
+            session = None
+
+        if session is None:
+            session = self._restore(session_id, now)
+
+        if session is None:
+            self.metrics["misses"] += 1
+            if not create:
+                return None
+            session = Session(session_id, now)
+            self.sessions[session_id] = session
+            self.memory_bytes += session.size
+        else:
+            self.metrics["hits"] += 1
+            self.sessions.move_to_end(session_id)
+
+        session.last_access = now
+        return session
+
+    def _drop_turn(self, session):
+        turn = session.turns.popleft()
+        session.tokens -= turn.tokens
+        session.size -= turn.size()
+        self.total_turns -= 1
+        self.total_tokens -= turn.tokens
+        self.memory_bytes -= turn.size()
+
+    def _release(self, session):
+        self.total_turns -= len(session.turns)
+        self.total_tokens -= session.tokens
+        self.memory_bytes -= session.size
+
+    def _evict(self, session, reason, spill=True):
+        del self.sessions[session.session_id]
+        self._release(session)
+        self.metrics["evictions"][reason] += 1
+        if spill and self.shared:
+            # The spill file is already current, and may be newer than this copy
+            pass
+        elif spill and self.spill_dir:
+            self._spill(session)
+        else:
+            self._remove_spilled(self._spill_name(session.session_id))
+
+    def _enforce_caps(self):
+        # The most recently used session is never evicted, so a caller always keeps its own turn
+        while len(self.sessions) > 1 and len(self.sessions) > self.max_sessions:
+            self._evict(next(iter(self.sessions.values())), "lru")
+        while len(self.sessions) > 1 and self.memory_bytes > self.max_memory_bytes:
+            self._evict(next(iter(self.sessions.values())), "memory")
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+
+        # Sessions are in LRU order, so stop at the first one that is still active
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            idle = now - session.last_access
+            if idle > self.ttl_seconds:
+                self._evict(session, "ttl", spill=False)
+            elif self.spill_dir and idle > self.spill_after_seconds:
+                del self.sessions[session.session_id]
+                self._release(session)
+                if not self.shared:
+                    self._spill(session)
+            else:
+                break
+
+        if self.shared:
+            self._sweep_directory(now)
+            return
+        for name, last_access in list(self._spilled.items()):
+            if now - last_access > self.ttl_seconds:
+                self._remove_spilled(name)
+                self.metrics["evictions"]["ttl"] += 1
+
+    def _sweep_directory(self, now):
+        # Every turn rewrites its session's file, so the modification time is the last access.
+        # Scanning the directory rather than this process's own spills also expires sessions
+        # (and leftover temp files) of processes that have exited.
+        try:
+            entries = list(os.scandir(self.spill_dir))
+        except OSError as e:
+            print(f"Failed to sweep chat sessions: {e}")
+            return
+        spilled = {}
+        spilled_bytes = 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime <= self.ttl_seconds:
+                if entry.name.endswith(".json"):
+                    spilled[entry.name] = stat.st_mtime
+                spilled_bytes += stat.st_size
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            if entry.name.endswith(".json"):
+                self.metrics["evictions"]["ttl"] += 1
+        self._spilled = spilled
+        self.spilled_bytes = spilled_bytes
+
+    def _spill_name(self, session_id):
+        # Hash the ID so arbitrary client-supplied IDs are safe file names
+        return hashlib.sha1(session_id.encode("utf-8")).hexdigest() + ".json"
+
+    def _spill(self, session):
+        name = self._spill_name(session.session_id)
+        path = os.path.join(self.spill_dir, name)
+        # Written aside and renamed, so readers in other processes never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "sessionId": session.session_id,
+                    "lastAccess": session.last_access,
+                    "turns": [[t.role, t.text, t.tokens, t.timestamp] for t in session.turns]
+                }, f)
+            os.replace(temp_path, path)
+            session.disk_version = _file_version(os.stat(path))
+            self._spilled[name] = session.last_access
+            self.metrics["spills"] += 1
+        except OSError as e:
+            print(f"Failed to spill chat session: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _is_current(self, session):
+        try:
+            return _file_version(os.stat(os.path.join(self.spill_dir, self._spill_name(session.session_id)))) == session.disk_version
+        except OSError:
+            return False
+
+    def _restore(self, session_id, now):
+        name = self._spill_name(session_id)
+        # Only the shared directory can hold sessions this process hasn't written itself
+        if not self.shared and name not in self._spilled:
+            return None
+        path = os.path.join(self.spill_dir, name)
+        version = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                version = _file_version(os.fstat(f.fileno()))
+                data = json.load(f)
+        except FileNotFoundError:
+            data = None
+            self._spilled.pop(name, None)
+        except (OSError, ValueError) as e:
+            print(f"Failed to restore chat session: {e}")
+            data = None
+        if not self.shared or data is None:
+            self._remove_spilled(name)
+
+        if data is None or now - data["lastAccess"] > self.ttl_seconds:
+            if data is not None:
+                self._remove_spilled(name)
+            return None
+
+        session = Session(session_id, now)
+        session.disk_version = version
+        if self.shared:
+            self._spilled[name] = data["lastAccess"]
+        for role, text, tokens, timestamp in data["turns"]:
+            role = sys.intern(role)
+            text = self._shared_texts.get(text, text)
+            turn = Turn(role, text, tokens, timestamp)
+            session.turns.append(turn)
+            session.tokens += tokens
+            session.size += turn.size()
+
+        self.sessions[session_id] = session
+        self.total_turns += len(session.turns)
+        self.total_tokens += session.tokens
+        self.memory_bytes += session.size
+        self.metrics["restores"] += 1
+        return session
+
+    def _remove_spilled(self, name):
+        # A shared directory also holds files other processes wrote
+        if self._spilled.pop(name, None) is None and not self.shared:
+            return
+        try:
+            os.remove(os.path.join(self.spill_dir, name))
+        except OSError:
+            pass
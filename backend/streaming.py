@@ -0,0 +1,78 @@
+# Streaming NDJSON responses and cursor pagination
+# Large list endpoints can stream one JSON record per line from a generator when the
+# client sends `Accept: application/x-ndjson`, so peak memory stays at one record and the
+# first bytes go out immediately. Pages are addressed by an opaque cursor holding the last
+# key returned, which stays valid when records are added or removed between requests.
+
+import base64
+import json
+
+from flask import Response, jsonify, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def wants_ndjson(request):
+    """True if the client prefers NDJSON over a single JSON document"""
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def paginate(keys, cursor=None, limit=None):
+    """
+    Select one page of keys after the cursor
+
+    Parameters:
+    keys (iterable): Record keys in ascending order; may be a lazy generator
+    cursor (str): Cursor returned with the previous page, or None for the first page
+    limit (int): Maximum page size, or None for everything after the cursor
+
+    Returns:
+    tuple: (list of keys in the page, cursor for the next page or None)
+    """
+    after = decode_cursor(cursor) if cursor else None
+    page = []
+    for key in keys:
+        try:
+            if after is not None and key <= after:
+                continue
+        except TypeError:
+            raise ValueError("Invalid cursor")
+        if limit is not None and len(page) == limit:
+            return page, encode_cursor(page[-1])
+        page.append(key)
+    return page, None
+
+
+def ndjson_response(records, next_cursor=None):
+    """Stream an iterable of JSON serializable records, one per line"""
+    def generate():
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def list_response(request, records, next_cursor=None):
+    """Respond with NDJSON or a JSON array depending on the request's Accept header"""
+    if wants_ndjson(request):
+        return ndjson_response(records, next_cursor)
+
+    response = jsonify(list(records))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
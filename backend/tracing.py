@@ -0,0 +1,349 @@
+# Lightweight request tracing
+# A trace is a tree of timed spans for one request. The active span lives in a context
+# variable, so code anywhere below a request (analyzers, caches, models) can open a child
+# span with `with span("stage"):` without being handed a tracer. When the request isn't
+# being recorded, span() returns a shared no-op object and costs one context lookup.
+#
+# Sampling: a request is recorded if it is head sampled (TRACE_SAMPLE_RATE, or an incoming
+# W3C traceparent header with the sampled flag), or whenever a slow-request threshold is
+# set, in which case unsampled traces are kept only if they end up slow or fail (tail
+# sampling). Kept traces go to an in-memory ring buffer and, optionally, to local files
+# as OTLP/JSON (one ExportTraceServiceRequest per line).
+
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from flask import g, request
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+TRACE_ID_HEADER = "X-Trace-Id"
+
+# OTLP enum values
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(header):
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+    tuple: (trace_id, parent_span_id, sampled) or None if the header is missing or invalid
+    """
+    match = TRACEPARENT_PATTERN.match(header.strip().lower()) if header else None
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Trace:
+    # IDs are generated on first use: most tail-sampled traces are discarded without ever needing them
+    __slots__ = ("_trace_id", "head_sampled", "spans")
+
+    def __init__(self, trace_id, head_sampled):
+        self._trace_id = trace_id
+        self.head_sampled = head_sampled
+        self.spans = []
+
+    @property
+    def trace_id(self):
+        if self._trace_id is None:
+            self._trace_id = _new_id(128)
+        return self._trace_id
+
+
+class Span:
+    __slots__ = ("trace", "name", "_span_id", "parent", "kind", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, trace, name, parent, attributes, kind=SPAN_KIND_INTERNAL):
+        """parent is the parent Span, a remote parent span ID from traceparent, or None"""
+        self.trace = trace
+        self.name = name
+        self._span_id = None
+        self.parent = parent
+        self.kind = kind
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = None
+        self._token = None
+        trace.spans.append(self)
+
+    @property
+    def span_id(self):
+        if self._span_id is None:
+            self._span_id = _new_id(64)
+        return self._span_id
+
+    @property
+    def parent_id(self):
+        return self.parent.span_id if isinstance(self.parent, Span) else self.parent
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        return False
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Child span of the active span, or a no-op if no trace is being recorded"""
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent, attributes)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span_):
+    record = {
+        "traceId": span_.trace.trace_id,
+        "spanId": span_.span_id,
+        "name": span_.name,
+        "kind": span_.kind,
+        "startTimeUnixNano": str(span_.start_ns),
+        "endTimeUnixNano": str(span_.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span_.attributes.items()],
+        "status": {"code": STATUS_ERROR, "message": span_.error} if span_.error else {"code": STATUS_UNSET}
+    }
+    parent_id = span_.parent_id
+    if parent_id:
+        record["parentSpanId"] = parent_id
+    return record
+
+
+class FileExporter:
+    """Appends kept traces as OTLP/JSON lines to <export_dir>/traces-<pid>.jsonl from a background thread"""
+
+    def __init__(self, export_dir, service_name, max_pending=1000):
+        self.export_dir = export_dir
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+        self.max_pending = max_pending
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, spans):
+        # Threads don't survive fork, so each process starts its own writer on first use
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    os.makedirs(self.export_dir, exist_ok=True)
+                    self._queue = queue.Queue(self.max_pending)
+                    threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            # Never block a request on the exporter
+            self.dropped += 1
+
+    def _run(self):
+        path = os.path.join(self.export_dir, f"traces-{os.getpid()}.jsonl")
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    for spans in batch:
+                        f.write(json.dumps({"resourceSpans": [{
+                            "resource": self.resource,
+                            "scopeSpans": [{"scope": {"name": "arogya.tracing"}, "spans": [_otlp_span(s) for s in spans]}]
+                        }]}) + "\n")
+            except OSError as e:
+                print(f"Error exporting traces: {e}")
+
+
+class Tracer:
+    def __init__(self, sample_rate=0.0, slow_threshold_ms=None, buffer_size=256, exporter=None):
+        """
+        Parameters:
+        sample_rate (float): Fraction of requests always recorded (head sampling)
+        slow_threshold_ms (float): Also record every other request and keep it if it takes
+            at least this long or fails (tail sampling); None disables
+        buffer_size (int): Number of recent kept traces held in memory
+        exporter (FileExporter): Optional destination for kept traces
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.exporter = exporter
+        self.enabled = sample_rate > 0 or slow_threshold_ms is not None
+        self.recent = deque(maxlen=buffer_size)
+        self.metrics = {"started": 0, "kept": 0, "discarded": 0}
+
+    def start(self, name, traceparent=None, attributes=None):
+        """
+        Begin a trace and return its root span (not yet entered), or None if it isn't recorded
+        """
+        if not self.enabled:
+            return None
+        parsed = parse_traceparent(traceparent)
+        head_sampled = random.random() < self.sample_rate
+        if parsed is not None:
+            head_sampled = head_sampled or parsed[2]
+        if not head_sampled and self.slow_threshold_ms is None:
+            return None
+
+        self.metrics["started"] += 1
+        trace = Trace(parsed[0] if parsed else None, head_sampled)
+        return Span(trace, name, parsed[1] if parsed else None, attributes or {}, kind=SPAN_KIND_SERVER)
+
+    def finish(self, root):
+        """Apply tail sampling to an ended root span; returns True if the trace was kept"""
+        trace = root.trace
+        keep = (
+            trace.head_sampled
+            or root.error is not None
+            or (self.slow_threshold_ms is not None and root.duration_ms >= self.slow_threshold_ms)
+        )
+        if not keep:
+            self.metrics["discarded"] += 1
+            return False
+
+        self.metrics["kept"] += 1
+        # Fix the lazy IDs now, before the trace is shared with the exporter thread
+        for span_ in trace.spans:
+            span_.span_id
+        trace.trace_id
+        self.recent.append(trace)
+        if self.exporter is not None:
+            self.exporter.export(trace.spans)
+        return True
+
+    @staticmethod
+    def summarize(trace):
+        root = trace.spans[0]
+        return {
+            "traceId": trace.trace_id,
+            "name": root.name,
+            "startTime": root.start_ns // 1000 / 1e6,
+            "durationMs": round(root.duration_ms, 3),
+            "status": root.attributes.get("http.status_code"),
+            "error": root.error,
+            "headSampled": trace.head_sampled,
+            "spans": [
+                {
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id,
+                    "name": s.name,
+                    "offsetMs": round((s.start_ns - root.start_ns) / 1e6, 3),
+                    "durationMs": round(s.duration_ms, 3),
+                    "attributes": s.attributes,
+                    "error": s.error
+                }
+                for s in trace.spans
+            ]
+        }
+
+    def recent_traces(self, limit=50, min_duration_ms=0):
+        """Most recent kept traces first"""
+        traces = []
+        for trace in reversed(list(self.recent)):
+            if trace.spans[0].duration_ms >= min_duration_ms:
+                traces.append(self.summarize(trace))
+                if len(traces) >= limit:
+                    break
+        return traces
+
+    def get_trace(self, trace_id):
+        for trace in list(self.recent):
+            if trace.trace_id == trace_id:
+                return self.summarize(trace)
+        return None
+
+    def init_app(self, app):
+        """Trace every request; register before other request hooks so their time is included"""
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        root = self.start(
+            f"{request.method} {rule}",
+            request.headers.get("traceparent"),
+            {"http.method": request.method, "http.target": request.path}
+        )
+        if root is not None:
+            root.__enter__()
+            g.trace_root = root
+
+    def _after_request(self, response):
+        root = g.pop("trace_root", None)
+        if root is not None:
+            root.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                root.error = f"HTTP {response.status_code}"
+            root.__exit__(None, None, None)
+            if self.finish(root):
+                response.headers[TRACE_ID_HEADER] = root.trace.trace_id
+        return response
+
+    def _teardown_request(self, exc):
+        # Only reached with a live root if after_request never ran
+        root = g.pop("trace_root", None)
+        if root is not None:
+            root.__exit__(type(exc) if exc else None, exc, None)
+            self.finish(root)
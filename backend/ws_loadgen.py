@@ -0,0 +1,188 @@
+# Load generator for the companion WebSocket server
+# Opens many connections to ws_server.py and keeps them open. Most of them stay idle
+# (they only answer the server's heartbeat pings). A subset chats at a steady rate,
+# alternating between two sessions on the same connection. Every few seconds it prints
+# the open connection count and reply latency; at the end it prints the server's memory
+# per connection, taken from GET /stats.
+#
+# Loopback connections are spread over several 127.0.0.x source addresses, so the
+# count isn't capped by the ephemeral port range of a single address. Chatting connections
+# send the API key loadgen-<index> so each gets its own rate limit bucket; start the server
+# with those keys allowed, e.g.
+#   API_KEYS=$(python -c "print(','.join(f'loadgen-{i}' for i in range(500)))") python ws_server.py
+# Run with: python ws_loadgen.py [--connections 20000] [--active 500] [--rate 1] [--duration 60]
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import resource
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+from websockets.asyncio.client import connect
+
+MESSAGES = [
+    "I have been feeling a lot of anxiety at work",
+    "I can't sleep well lately",
+    "Everything feels stressful this week",
+    "I think I might be depressed",
+    "I just wanted to talk to someone"
+]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def fetch_stats(url):
+    parts = urllib.parse.urlsplit(url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    with urllib.request.urlopen(f"{scheme}://{parts.netloc}/stats", timeout=10) as response:
+        return json.load(response)
+
+
+class LoadGenerator:
+    def __init__(self, url, connections, active, rate, source_ips):
+        self.url = url
+        self.connections = connections
+        self.active = active
+        self.rate = rate
+        loopback = urllib.parse.urlsplit(url).hostname in ("127.0.0.1", "localhost")
+        self.source_ips = [f"127.0.0.{i}" for i in range(1, source_ips + 1)] if loopback else [None]
+
+        self.open = 0
+        self.failed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latencies = []
+        self.stopping = asyncio.Event()
+
+    async def connection(self, index):
+        source_ip = self.source_ips[index % len(self.source_ips)]
+        options = {"local_addr": (source_ip, 0)} if source_ip else {}
+        try:
+            websocket = await connect(
+                self.url,
+                # A key per chatting connection, so each one gets its own rate limit bucket
+                additional_headers={"X-API-Key": f"loadgen-{index}"} if index < self.active else None,
+                compression=None,
+                ping_interval=None,
+                open_timeout=30,
+                **options
+            )
+        except Exception:
+            self.failed += 1
+            return
+
+        self.open += 1
+        try:
+            if index < self.active:
+                await self.chat(websocket, index)
+            else:
+                await self.stopping.wait()
+        except Exception:
+            if not self.stopping.is_set():
+                self.dropped += 1
+        finally:
+            self.open -= 1
+            await websocket.close()
+
+    async def chat(self, websocket, index):
+        sessions = [f"loadgen-{index}-a", f"loadgen-{index}-b"]
+        interval = 1 / self.rate
+        # Random start so active connections don't send in lockstep
+        await asyncio.sleep(random.uniform(0, interval))
+        for turn in itertools.count():
+            if self.stopping.is_set():
+                return
+            started = time.perf_counter()
+            await websocket.send(json.dumps({
+                "type": "chat",
+                "id": turn,
+                "sessionId": sessions[turn % 2],
+                "message": random.choice(MESSAGES)
+            }))
+            reply = json.loads(await websocket.recv())
+            self.latencies.append(time.perf_counter() - started)
+            if reply["type"] != "reply":
+                self.errors += 1
+            await asyncio.sleep(max(0, interval - (time.perf_counter() - started)))
+
+    def report(self, elapsed):
+        latencies, self.latencies = np.array(self.latencies), []
+        line = f"{elapsed:6.1f}s  open {self.open:>6}  failed {self.failed:>5}  dropped {self.dropped:>5}"
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            line += f"  replies {len(latencies):>6}  p50 {p50:6.2f} ms  p95 {p95:6.2f} ms  p99 {p99:6.2f} ms"
+        print(line, flush=True)
+
+    async def run(self, duration, ramp_rate):
+        started = time.perf_counter()
+        tasks = []
+        for index in range(self.connections):
+            tasks.append(asyncio.create_task(self.connection(index)))
+            # Open connections at ramp_rate per second
+            delay = (index + 1) / ramp_rate - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if time.perf_counter() - started >= duration:
+                break
+        print(f"Opened {len(tasks)} connections in {time.perf_counter() - started:.1f}s", flush=True)
+
+        next_report = time.perf_counter() + 5
+        while time.perf_counter() - started < duration:
+            await asyncio.sleep(min(1, max(0, next_report - time.perf_counter())))
+            if time.perf_counter() >= next_report:
+                self.report(time.perf_counter() - started)
+                next_report += 5
+        return tasks
+
+    async def stop(self, tasks):
+        self.stopping.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def main_async(args):
+    generator = LoadGenerator(args.url, args.connections, args.active, args.rate, args.source_ips)
+    before = fetch_stats(args.url)
+    tasks = await generator.run(args.duration, args.ramp)
+    after = fetch_stats(args.url)
+    await generator.stop(tasks)
+
+    held = after["connections"] - before["connections"]
+    print(f"\nServer held {after['connections']} connections (peak {after['peakConnections']}), "
+          f"{after['messages'] - before['messages']} messages, {after['idleClosed'] - before['idleClosed']} idle closes")
+    if held > 0:
+        growth = after["rssBytes"] - before["rssBytes"]
+        print(f"Server RSS {after['rssBytes'] / 1024 / 1024:.0f} MB, "
+              f"{growth / held / 1024:.1f} KB per connection")
+    if generator.errors:
+        print(f"{generator.errors} turns were answered with an error frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for ws_server.py")
+    parser.add_argument("--url", default="ws://127.0.0.1:5001/ws/mental-health")
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--active", type=int, default=500, help="connections that send messages")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per active connection")
+    parser.add_argument("--duration", type=float, default=60, help="seconds, including the ramp up")
+    parser.add_argument("--ramp", type=float, default=2000, help="new connections per second")
+    parser.add_argument("--source-ips", type=int, default=8, help="loopback source addresses to spread connections over")
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    if fd_limit < args.connections + 100:
+        print(f"Open file limit is {fd_limit}; raise it (ulimit -n) to open {args.connections} connections")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# WebSocket transport for the mental health companion
+# A client opens one connection at /ws/mental-health and keeps it for the whole
+# conversation, instead of paying for an HTTP request, CORS handling and JSON framing on
+# every turn. The server is a single asyncio event loop: an idle connection costs one
+# socket and a suspended coroutine, so one process holds tens of thousands of them.
+#
+# Frames are JSON text:
+#   -> {"type": "chat", "message": "...", "sessionId": "optional", "id": 1}
+#   <- {"type": "reply", "id": 1, "sessionId": "...", "response": "...", "timestamp": "..."}
+#   -> {"type": "end", "sessionId": "..."}
+#   <- {"type": "ended", "id": null, "sessionId": "...", "ended": true}
+#   <- {"type": "error", "id": 1, "error": "...", "retryAfter": 2}
+# One connection can carry any number of sessions. Turns of different sessions run
+# concurrently, and turns of the same session are answered in order.
+#
+# Replies come from the same chatbot and "chat" admission class as
+# POST /api/mental-health/chat. This is a separate process with its own session store, so
+# a conversation stays on one transport unless both processes share CHAT_SPILL_DIR with
+# CHAT_SHARED_SESSIONS=1. Session store and shared limiter calls can touch the disk or
+# wait on a file lock, so they run on the loop's thread pool, never on the loop itself.
+# Connections are closed by:
+#   - heartbeat: the server pings every WS_PING_INTERVAL seconds and drops peers that
+#     don't answer within WS_PING_TIMEOUT
+#   - idle timeout: connections that send nothing for WS_IDLE_TIMEOUT seconds
+# Backpressure: a connection has at most WS_MAX_IN_FLIGHT turns pending. Past that the
+# server stops reading from it: unread frames queue up to a small limit and then the
+# socket is no longer read, so a client that floods the server is slowed down by TCP
+# flow control instead of growing server memory. Sends wait while the outgoing buffer
+# is above its limit.
+#
+# Run with: python ws_server.py [--port 5001]
+# GET /stats on the same port returns connection counts and memory use.
+
+import argparse
+import asyncio
+import contextlib
+import math
+import os
+import resource
+import signal
+import uuid
+from datetime import datetime
+from http import HTTPStatus
+
+import msgspec
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+import server
+from rate_limit import API_KEY_HEADER, client_identity
+from schemas import ChatFrame, ClientFrame, decode
+
+WS_PATH = "/ws/mental-health"
+STATS_PATH = "/stats"
+
+_encoder = msgspec.json.Encoder()
+
+
+def raise_fd_limit():
+    """Raise the open file limit to its hard maximum; every connection uses a descriptor"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        target = hard if hard != resource.RLIM_INFINITY else 1 << 20
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def rss_bytes():
+    """Resident memory of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class CompanionServer:
+    def __init__(self, chatbot, sessions, admission=None, idle_timeout=900,
+                 max_connections=50000, max_in_flight=4):
+        """
+        Parameters:
+        chatbot: Object with get_response(message, history)
+        sessions (SessionStore): Conversation history for this process
+        admission (AdmissionController): Applies the "chat" class to every turn if set
+        idle_timeout (float): Seconds without a client frame before the connection is closed
+        max_connections (int): Further handshakes are refused with 503
+        max_in_flight (int): Turns a single connection may have pending
+        """
+        self.chatbot = chatbot
+        self.sessions = sessions
+        self.admission = admission
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+
+        self.connections = 0
+        self.metrics = {
+            "peakConnections": 0,
+            "accepted": 0,
+            "refused": 0,
+            "idleClosed": 0,
+            "messages": 0,
+            "errors": 0
+        }
+
+    def stats(self):
+        return dict(
+            self.metrics,
+            connections=self.connections,
+            rssBytes=rss_bytes(),
+            sessions=self.sessions.stats()
+        )
+
+    def process_request(self, connection, request):
+        """Route the HTTP request before the WebSocket handshake"""
+        if request.path == STATS_PATH:
+            return self._stats_response(connection)
+        if request.path != WS_PATH:
+            return connection.respond(HTTPStatus.NOT_FOUND, "Not found\n")
+        if self._client(connection, request) is None:
+            return connection.respond(HTTPStatus.UNAUTHORIZED, "Unknown API key\n")
+        if self.connections >= self.max_connections:
+            self.metrics["refused"] += 1
+            return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again shortly\n")
+        return None
+
+    def _client(self, connection, request):
+        # Same rule as the HTTP endpoints: allowed API keys, otherwise the remote address
+        api_keys = self.admission.api_keys if self.admission is not None else frozenset()
+        return client_identity(request.headers.get(API_KEY_HEADER), connection.remote_address[0], api_keys)
+
+    async def _stats_response(self, connection):
+        # Session store stats take its lock and may sweep, so they run off the loop
+        stats = await asyncio.get_running_loop().run_in_executor(None, self.stats)
+        response = connection.respond(HTTPStatus.OK, _encoder.encode(stats).decode() + "\n")
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    async def handler(self, connection):
+        """Serve one connection until the client leaves, goes quiet or stops answering pings"""
+        client = self._client(connection, connection.request)
+        self.connections += 1
+        self.metrics["accepted"] += 1
+        self.metrics["peakConnections"] = max(self.metrics["peakConnections"], self.connections)
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        # Session ID -> [lock, turns holding or waiting for it], so same-session turns stay in order
+        session_locks = {}
+        tasks = set()
+        try:
+            while True:
+                # Don't read the next frame until a turn slot is free
+                await in_flight.acquire()
+                try:
+                    raw = await asyncio.wait_for(connection.recv(decode=False), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    self.metrics["idleClosed"] += 1
+                    await connection.close(1001, "Idle timeout")
+                    return
+                self.metrics["messages"] += 1
+                task = asyncio.create_task(self._handle_frame(connection, raw, client, session_locks, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections -= 1
+            for task in tasks:
+                task.cancel()
+
+    @contextlib.asynccontextmanager
+    async def _session_lock(self, session_locks, session_id):
+        """Hold the connection's lock for one session; frames of a session are handled in arrival order"""
+        entry = session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del session_locks[session_id]
+
+    def _record_turn(self, session_id, message, response):
+        self.sessions.append(session_id, "user", message)
+        self.sessions.append(session_id, "assistant", response)
+
+    def _release_if_admitted(self, check):
+        if not check.cancelled() and check.exception() is None and check.result() is None:
+            asyncio.get_running_loop().run_in_executor(None, self.admission.release, "chat")
+
+    async def _send(self, connection, payload):
+        # Waits while the connection's write buffer is above its high-water mark
+        await connection.send(_encoder.encode(payload), text=True)
+
+    async def _handle_frame(self, connection, raw, client, session_locks, in_flight):
+        try:
+            try:
+                frame = decode(raw, ClientFrame)
+            except msgspec.DecodeError as e:
+                self.metrics["errors"] += 1
+                await self._send(connection, {"type": "error", "id": None, "error": f"Invalid message: {e}"})
+                return
+
+            if not isinstance(frame, ChatFrame):
+                # Queued behind the session's pending turns, so they can't recreate it afterwards
+                async with self._session_lock(session_locks, frame.session_id):
+                    ended = await asyncio.get_running_loop().run_in_executor(None, self.sessions.end, frame.session_id)
+                await self._send(connection, {"type": "ended", "id": frame.id, "sessionId": frame.session_id, "ended": ended})
+                return
+
+            if not frame.message:
+                self.metrics["errors"] += 1
+                await self._send(connection, {"type": "error", "id": frame.id, "error": "No message provided"})
+                return
+
+            session_id = frame.session_id or str(uuid.uuid4())
+            async with self._session_lock(session_locks, session_id):
+                payload = await self._turn(frame, session_id, client)
+            await self._send(connection, payload)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            # Answer the turn rather than leave the client waiting for a reply
+            print(f"Error handling chat frame: {e}")
+            self.metrics["errors"] += 1
+            try:
+                await self._send(connection, {"type": "error", "id": None, "error": "Internal server error"})
+            except ConnectionClosed:
+                pass
+        finally:
+            in_flight.release()
+
+    async def _turn(self, frame, session_id, client):
+        """Run one chat turn; returns the reply or error frame"""
+        loop = asyncio.get_running_loop()
+        if self.admission is not None:
+            check = loop.run_in_executor(None, self.admission.check, "chat", client)
+            try:
+                rejected = await asyncio.shield(check)
+            except asyncio.CancelledError:
+                # The check still completes in its thread; give back a slot it grants
+                check.add_done_callback(self._release_if_admitted)
+                raise
+            if rejected is not None:
+                status, retry_after = rejected
+                self.metrics["errors"] += 1
+                return {
+                    "type": "error",
+                    "id": frame.id,
+                    "sessionId": session_id,
+                    "error": "Rate limit exceeded" if status == 429 else "Server busy, try again shortly",
+                    "retryAfter": max(1, math.ceil(retry_after))
+                }
+        try:
+            history = await loop.run_in_executor(None, self.sessions.history, session_id)
+            if getattr(self.chatbot, "model", None) is None:
+                # Rule-based replies take microseconds, answer them on the loop
+                response = self.chatbot.get_response(frame.message, history)
+            else:
+                # Model inference blocks, so it runs on the loop's thread pool
+                response = await loop.run_in_executor(None, self.chatbot.get_response, frame.message, history)
+            await loop.run_in_executor(None, self._record_turn, session_id, frame.message, response)
+        finally:
+            if self.admission is not None:
+                # Not awaited: a cancelled turn must still give its slot back
+                loop.run_in_executor(None, self.admission.release, "chat")
+
+        return {
+            "type": "reply",
+            "id": frame.id,
+            "sessionId": session_id,
+            "response": str(response),
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+async def run(companion, host, port, ping_interval, ping_timeout, max_message_bytes, origins=None):
+    stop = asyncio.get_running_loop().create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set_result, None)
+
+    async with serve(
+        companion.handler, host, port,
+        process_request=companion.process_request,
+        origins=origins,
+        # permessage-deflate keeps tens of KB of zlib state per connection; chat frames
+        # are small, so idle connections are much cheaper without it
+        compression=None,
+        ping_interval=ping_interval,
+        ping_timeout=ping_timeout,
+        max_size=max_message_bytes,
+        max_queue=16,
+        write_limit=32 * 1024,
+        backlog=4096
+    ):
+        print(f"Companion WebSocket server listening on ws://{host}:{port}{WS_PATH}")
+        await stop
+    print("Shutting down")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket transport for the mental health companion")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WS_PORT", 5001)))
+    args = parser.parse_args()
+
+    allowed_origins = os.environ.get("WS_ALLOWED_ORIGINS")
+    origins = [origin.strip() for origin in allowed_origins.split(",")] if allowed_origins else None
+
+    fd_limit = raise_fd_limit()
+    max_connections = int(os.environ.get("WS_MAX_CONNECTIONS", 50000))
+    if fd_limit < max_connections + 100:
+        print(f"Open file limit is {fd_limit}; raise it (ulimit -n) to hold {max_connections} connections")
+
+    companion = CompanionServer(
+        server.mental_health_chatbot,
+        server.chat_sessions,
+        admission=server.admission_controller,
+        idle_timeout=float(os.environ.get("WS_IDLE_TIMEOUT", 900)),
+        max_connections=max_connections,
+        max_in_flight=int(os.environ.get("WS_MAX_IN_FLIGHT", 4))
+    )
+    asyncio.run(run(
+        companion, args.host, args.port,
+        ping_interval=float(os.environ.get("WS_PING_INTERVAL", 20)),
+        ping_timeout=float(os.environ.get("WS_PING_TIMEOUT", 20)),
+        max_message_bytes=int(os.environ.get("WS_MAX_MESSAGE_BYTES", 16 * 1024)),
+        origins=origins
+    ))
+
+
+if __name__ == "__main__":
+    main()